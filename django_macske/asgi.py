@@ -15,4 +15,13 @@ application = ProtocolTypeRouter({
     "websocket": AuthMiddlewareStack(
         URLRouter(websocket_urlpatterns)
     ),
-})
\ No newline at end of file
+})
+
+from django.conf import settings
+from stream.detector import preload_detector
+from stream.spool import start_recovery
+
+if settings.CAT_DETECTOR_PRELOAD:
+    preload_detector()
+if settings.RECORDING_RECOVER_ON_START:
+    start_recovery()
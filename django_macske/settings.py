@@ -141,8 +141,89 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 STATIC_URL = '/static/'
 
+# How stream.views.serve_media sends files: None (Django streams them itself),
+# 'x-accel-redirect' (nginx, internal location at MEDIA_SENDFILE_PREFIX) or 'x-sendfile' (Apache/lighttpd)
+MEDIA_SENDFILE = None
+MEDIA_SENDFILE_PREFIX = '/protected-media/'
+
+DASH_PAGE_SIZE = 50  # items per page on the dashboard lists
+
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels.layers.InMemoryChannelLayer"
     }
-}
\ No newline at end of file
+}
+
+# Cat detector
+CAT_DETECTOR_PRELOAD = True  # load and warm up the model when the ASGI app starts
+CAT_DETECTOR_BACKEND = 'eager'  # 'eager', 'torchscript', 'quantized' or 'onnx' (run export_detector first)
+CAT_DETECTOR_MODEL_DIR = os.path.join(BASE_DIR, 'models')
+CAT_DETECTOR_CONFIDENCE = 0.5  # minimum Faster R-CNN cat score
+# Cheap classifier that runs first, Faster R-CNN only sees frames it lets through
+CAT_GATE = {
+    'enabled': True,
+    'threshold': 0.05,  # summed ImageNet cat class probability, keep low to not lose cats
+    'size': 224,
+}
+CAT_DETECTOR_BATCH_SIZE = 4  # max frames per forward pass
+CAT_DETECTOR_BATCH_DEADLINE = 0.05  # seconds to wait for a batch to fill up
+CAT_DETECTOR_INPUT = 'raw'  # 'raw' lores YUV arrays from picamera2, or 'jpeg' to decode the preview frames
+# What starts a detection: 'uhsz' (distance sensor), 'motion' (lores frame differencing),
+# 'uhsz_or_motion' or 'uhsz_and_motion' (sensor, but only while something moves)
+CAT_DETECTION_TRIGGER = 'uhsz_or_motion'
+CAT_DETECTION_COOLDOWN = 1.0  # seconds between two detections
+MOTION_TRIGGER_WINDOW = 0.5  # motion this recent counts
+MOTION_DETECTOR = {
+    'block': 8,  # downscale factor of the luma plane
+    'alpha': 0.05,  # background update rate
+    'pixel_threshold': 20,  # grey levels
+    'area_threshold': 0.01,  # fraction of blocks that must change
+}
+# Hardware the recorder reads, see stream/sources.py
+FRAME_SOURCE = {
+    'type': 'picamera',  # or 'jpeg_dir' / 'video' with 'path' and 'fps' to replay recorded footage
+    'width': 1920,
+    'height': 1080,
+    'lores_size': (960, 540),
+}
+# HC-SR04 on BCM pins, or 'scripted' with a 'trace' of [seconds, cm] pairs
+DISTANCE_SOURCE = {
+    'type': 'ultrasonic',
+    'trigger': 23,
+    'echo': 24,
+    'chip': 0,  # gpiochip the pins are on, lgpio numbering
+    'interval': 0.1,  # seconds between pings
+    'timeout': 0.05,  # give up on an echo after this many seconds
+    'window': 1.0,  # seconds of samples averaged into one distance
+}
+
+# Bounds of the queues between the recording stages
+PIPELINE_QUEUES = {
+    'detection': 4,  # frame pairs waiting for the detector, the oldest is dropped when full
+    'inference': 4,  # frames waiting inside the inference worker, the oldest is cancelled when full
+    'spool_frames': 120,  # full-res frames waiting for the spool's writer thread, new ones are dropped when full
+    'encoder_frames': 60,  # frames read ahead from a chunk's spool while ffmpeg encodes it
+}
+
+# Live view, every viewer moves between these tiers by its measured delivery latency
+VIEWER_TIERS = [
+    {'fps': 30, 'size': None, 'quality': None},  # lores JPEGs as the camera encoded them
+    {'fps': 15, 'size': 640, 'quality': 70},
+    {'fps': 5, 'size': 320, 'quality': 60},
+]
+VIEWER_ADAPTATION = {
+    'slow': 0.25,  # seconds, step down a tier above this latency
+    'fast': 0.08,  # seconds, step up a tier below this latency
+    'hold': 2.0,  # seconds to stay in a tier before changing again
+    'ack_timeout': 2.0,  # seconds to wait for a client's ACK before sending the next frame anyway
+}
+
+# Recording
+RECORDING_CHUNK_DURATION = 30  # seconds per chunk
+RECORDING_ENCODER_PROFILE = 'vp8_realtime'  # see stream.ffmpeg.ENCODER_PROFILES
+# Frames are journaled here until their chunk is encoded, so a crash doesn't lose them
+RECORDING_SPOOL_DIR = os.path.join(BASE_DIR, 'spool')
+# Safety cap on one chunk's spooled (raw MJPEG/H.264) frames, 30 s of 1080p MJPEG is roughly 150-250 MB
+RECORDING_SPOOL_MAX_BYTES = 500 * 1024 * 1024
+RECORDING_RECOVER_ON_START = True  # encode orphaned spools and close unfinished streams when the ASGI app starts
+RECORDING_RECOVERY_GRACE = 60  # seconds, streams started more recently than this are never considered orphaned
@@ -10,10 +10,10 @@ urlpatterns = [
     path('', views.index, name="index"),
     path('dash/', include(dash_urlpatterns)),
     path('stream/', views.stream, name="stream"),
-    path("randomcat/", views.randomcat, name="")
+    path("randomcat/", views.randomcat, name=""),
+    path(settings.MEDIA_URL.lstrip('/') + '<path:path>', views.serve_media, name='media'),
     # path('stream/', include(stream_urlpatterns)),
 ]
 
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file
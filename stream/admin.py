@@ -7,12 +7,12 @@ admin.site.register(Chunk)
 class ChunkInline(admin.TabularInline):  # or StackedInline
     model = Chunk
     extra = 0  # don't show empty rows
-    readonly_fields = ('id',)  # optional
+    readonly_fields = ('id', 'encode_speed',)  # optional
 
 @admin.register(VideoStream)
 class VideoStreamAdmin(admin.ModelAdmin):
-    list_display = ('id', 'started',)
-    readonly_fields = ('started',)
+    list_display = ('id', 'started', 'encoder_profile', 'chunk_count', 'total_bytes', 'detection_count', 'duration',)
+    readonly_fields = ('started', 'chunk_count', 'total_bytes', 'detection_count', 'duration',)
     inlines = [ChunkInline]
 
 
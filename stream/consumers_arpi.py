@@ -1,57 +1,41 @@
 import asyncio
 import json
 from datetime import datetime
-from picamera2 import Picamera2
-from picamera2.encoders import MJPEGEncoder
-from picamera2.outputs import FileOutput
 from django.core.files.base import ContentFile
 from channels.generic.websocket import AsyncWebsocketConsumer
 from asgiref.sync import sync_to_async as database_sync_to_async
-from stream.models import Chunk, VideoStream, CatDetection
-import io
-import threading
-from stream.ffmpeg import frames_to_webm_buffer, concatenate_webm_chunks
+from stream.models import VideoStream, CatDetection, chunk_file_name, combined_file_name
+import os
+from stream.ffmpeg import concatenate_chunks, encoder_extension, is_stream_copy
+from stream.detector import get_detector, get_inference_worker
+from stream.framebus import FrameBus
+from stream.manifest import read_manifest
+from stream.thumbnails import frame_size, make_derivatives
+from stream.motion import MotionDetector
+from stream.queues import DropOldestQueue
+from stream.spool import ChunkSpool, register_chunk
+from stream.viewers import get_viewer_hub, new_viewer
+from stream.sources import get_distance_source, get_frame_source
+from django.conf import settings
 
 
-import torch
-import torchvision
-from torchvision import transforms
-from PIL import Image
-import numpy as np
-
-
-import RPi.GPIO as GPIO
 import time
-import statistics
-
 
 
-class StreamingOutput(io.BufferedIOBase):
-    def __init__(self):
-        self.frame = None
-        self.condition = threading.Condition()
-
-    def write(self, buf):
-        with self.condition:
-            self.frame = buf
-            self.condition.notify_all()
-
 
 _recording_state = None
 _recording_lock = asyncio.Lock()
+# The loop only keeps weak references to tasks, fire-and-forget ones are held here until done
+_background_tasks = set()
 
 class ArpiStreamConsumer(AsyncWebsocketConsumer):
     # Class-level shared recording state
-    stream_group_name = 'camera_stream'
     
     async def connect(self):
 
-        # Join the camera stream group
-        await self.channel_layer.group_add(
-            self.stream_group_name,
-            self.channel_name
-        )
         await self.accept()
+        # Live frames are delivered by the viewer, at the rate this client can take
+        self.viewer = new_viewer(lambda frame: self.send(bytes_data=frame))
         
         # If recording is active, notify client
         async with _recording_lock:
@@ -61,35 +45,20 @@ class ArpiStreamConsumer(AsyncWebsocketConsumer):
                     "status": "recording_active",
                     "message": "Recording already in progress"
                 }))
-        
-        self.device = 'cpu'
-        self.model = torchvision.models.detection.fasterrcnn_mobilenet_v3_large_fpn(
-            pretrained=True
-        )
-
-        self.model.to(self.device)
-        self.model.eval()
-        
-        self.CAT_CLASS_ID = 17
-        self.confidence_threshold = 0.5
-
-        self.transform = transforms.Compose([
-            transforms.ToTensor(),
-        ])
 
-        
     async def disconnect(self, code):
-        # Leave the camera stream group
-        await self.channel_layer.group_discard(
-            self.stream_group_name,
-            self.channel_name
-        )
+        if getattr(self, 'viewer', None) is not None:
+            await self.viewer.stop()
         print(f"Client disconnected, but recording continues...")
 
 
     async def receive(self, text_data=None, bytes_data=None):
         if text_data:
             data = json.loads(text_data)
+            if data["_meta_action"] == "ACK":
+                # The client drew the last frame
+                self.viewer.ack()
+                return
             print(data)
             
             if data["_meta_action"] == "START":
@@ -101,54 +70,58 @@ class ArpiStreamConsumer(AsyncWebsocketConsumer):
                         }))
                         return
                     
+                    source = get_frame_source()
+                    encoder_profile = data.get("encoder_profile", settings.RECORDING_ENCODER_PROFILE)
+                    if encoder_profile not in VideoStream.ENCODER_PROFILE_CHOICES.values:
+                        encoder_profile = settings.RECORDING_ENCODER_PROFILE
+                    if is_stream_copy(encoder_profile) and not source.supports_stream_copy:
+                        encoder_profile = settings.RECORDING_ENCODER_PROFILE
+                    stream_copy = is_stream_copy(encoder_profile)
+
                     # Initialize shared recording state
+                    loop = asyncio.get_running_loop()
                     _recording_state = {
-                        'chunk_frame_limit': 900,
                         'current_chunk_number': 0,
                         'queue': asyncio.Queue(),
-                        'frames': [],
+                        'spool': None,
                         'signal_to_stop': 0,
-                        'picam2': Picamera2(),
-                        'fullres_output': StreamingOutput(),
-                        'lores_output': StreamingOutput(),
-                        'fullres_encoder': MJPEGEncoder(),
-                        'lores_encoder': MJPEGEncoder(),
-                        'cat_analyzation_queue': asyncio.Queue(),
+                        'source': source,
+                        'fullres_bus': FrameBus(loop),
+                        'lores_bus': FrameBus(loop),
+                        'stream_copy': stream_copy,
+                        # Detection only cares about recent frames, the oldest waiting one is dropped
+                        'cat_analyzation_queue': DropOldestQueue(settings.PIPELINE_QUEUES['detection'], 'detection'),
                         'cat_detections_in_current_chunk': [],
-                        'uhsz_queue': asyncio.Queue(),
+                        # Sensor signals coalesce, only the newest one matters
+                        'uhsz_queue': DropOldestQueue(1, 'uhsz'),
+                        'uhsz_distances': DropOldestQueue(1, 'distance'),
+                        'inference_worker': None,
+                        'trigger': settings.CAT_DETECTION_TRIGGER,
+                        'last_trigger': 0,
+                        'motion': MotionDetector(**settings.MOTION_DETECTOR) if 'motion' in settings.CAT_DETECTION_TRIGGER else None,
                     }
                     
                     state = _recording_state
                     
-                    # Configure camera
-                    picam2_config = state['picam2'].create_video_configuration(
-                        main={"size": (1920, 1080), "format": "RGB888"},
-                        lores={"size": (960, 540), "format": "YUV420"},
-                        controls={"FrameRate": 30}
-                    )
-                    state['picam2'].configure(picam2_config)
-                    
                     # Create video stream record
-                    state['vs'] = await database_sync_to_async(VideoStream.objects.create)(source=0)
+                    state['vs'] = await database_sync_to_async(VideoStream.objects.create)(source=0, encoder_profile=encoder_profile)
                     
                     # Start recording
-                    state['picam2'].start_recording(
-                        state['fullres_encoder'], 
-                        FileOutput(state['fullres_output'])
-                    )
-                    
-                    state['picam2'].start_encoder(
-                        state['lores_encoder'], 
-                        FileOutput(state['lores_output']),
-                        name="lores"
+                    source.start(
+                        state['fullres_bus'],
+                        state['lores_bus'],
+                        stream_copy=stream_copy,
+                        on_lores_luma=self._detect_motion if state['motion'] is not None else None,
+                        keep_lores=settings.CAT_DETECTOR_INPUT == 'raw',
                     )
                     
                     # Start worker tasks
                     state['worker_task'] = asyncio.create_task(self._worker_save_chunk())
                     state['catdet_task'] = asyncio.create_task(self._cat_analyzation())
                     state['camera_task'] = asyncio.create_task(self._use_camera())
-                    state['video_combination_task'] = asyncio.create_task(self._video_combination_task())
-                    state['uhsz_task'] = asyncio.create_task(self._use_uhsz())
+                    state['broadcast_task'] = asyncio.create_task(self._broadcast_frames())
+                    state['trigger_task'] = asyncio.create_task(self._trigger_cat_analyzation())
+                    state['uhsz_task'] = asyncio.create_task(self._use_uhsz()) if 'uhsz' in state['trigger'] else None
                     
                     print(f'Started recording: {state["vs"].started.strftime("%Y_%m_%d_%H_%M_%S")}')
                 
@@ -162,266 +135,296 @@ class ArpiStreamConsumer(AsyncWebsocketConsumer):
                     
                     state = _recording_state
                     state['signal_to_stop'] = 1
-                    await asyncio.sleep(0.5)
                     
-                    # Stop encoders
-                    try:
-                        state['picam2'].stop_recording()
-                        state['picam2'].stop_encoder()
-                        state['picam2'].close()
-                    except:
-                        pass
+                    # Stop the camera
+                    await asyncio.to_thread(state['source'].stop)
+
+                    # Let the readers drain what the encoders already published
+                    await asyncio.sleep(0)
+                    state['fullres_bus'].close()
+                    state['lores_bus'].close()
+                    await state['camera_task']
+                    await state['broadcast_task']
+                    await state['trigger_task']
                     
+                    # Wait for the detections still in flight, so they're attached to the last chunk
+                    await state['cat_analyzation_queue'].put(None)
+                    await state['catdet_task']
+
                     # Save remaining frames
-                    if len(state['frames']) > 0:
-                        await state['queue'].put((state['frames'].copy(), state['current_chunk_number'], state['cat_detections_in_current_chunk'].copy()))
+                    if state['spool'] is not None:
+                        await self._queue_current_chunk(state)
                     
-                    await state['queue'].put((None, None, None))
-                    await state['cat_analyzation_queue'].put(None)
+                    await state['queue'].put((None, None))
                     await state['worker_task']
-                    await state['catdet_task']
-                    await state['video_combination_task']
-                    await state['uhsz_task']
+                    if state['uhsz_task'] is not None:
+                        # Cancelling is the stop signal, a sentinel could be dropped by the coalescing queue
+                        state['uhsz_task'].cancel()
+                        try:
+                            await state['uhsz_task']
+                        except asyncio.CancelledError:
+                            pass
                     
                     # Update database
                     state['vs'].stopped = datetime.now()
-                    await database_sync_to_async(state['vs'].save)()
+                    await database_sync_to_async(state['vs'].save)(update_fields=['stopped'])
                     
                     print(f"Recording stopped: {state['vs'].id}")
                     _recording_state = None
 
+                # The manifest already covers playback, a single file is only built on request
+                if data.get("combine"):
+                    task = asyncio.create_task(self._combine_stream(state['vs']))
+                    _background_tasks.add(task)
+                    task.add_done_callback(_background_tasks.discard)
+
 
     async def _use_camera(self):
-        """Collect full-res frames and stream low-res to websocket"""
+        """Journal full-res frames into the current chunk's spool"""
         state = _recording_state
         if not state:
             return
-        frame_analyzation_counter = 0
+        cursor = state['fullres_bus'].subscribe('recorder')
         while True:
-            if state['signal_to_stop'] == 1:
+            fullres_frame = await cursor.next()
+            if fullres_frame is None:
                 break
-                
+
+            # JPEGs can be cut anywhere, H.264 only right before a keyframe
+            keyframe = True
+            if state['stream_copy']:
+                fullres_frame, keyframe = fullres_frame
+
             # Check if we need to save a chunk
-            if len(state['frames']) >= state['chunk_frame_limit']:
-                await state['queue'].put((state['frames'].copy(), state['current_chunk_number'], state['cat_detections_in_current_chunk'].copy()))
-                state['current_chunk_number'] += 1
-                state['frames'] = []
-            
-            # Collect full resolution frame for recording
-            with state['fullres_output'].condition:
-                state['fullres_output'].condition.wait()
-                fullres_frame = state['fullres_output'].frame
-                if fullres_frame:
-                    state['frames'].append(fullres_frame)
-            
-            # Broadcast low resolution frame to all connected clients
-            try:
-                with state['lores_output'].condition:
-                    state['lores_output'].condition.wait()
-                    lores_frame = state['lores_output'].frame
-                    if lores_frame:
-                        frame_analyzation_counter += 1
-                        # Send to all clients in the group
-                        await self.channel_layer.group_send(
-                            self.stream_group_name,
-                            {
-                                'type': 'stream_frame',
-                                'frame': lores_frame
-                            }
-                        )            
-            except Exception as e:
-                print(f"Error broadcasting frame: {e}")
-            
-            try:
-                uhsz_signal = state['uhsz_queue'].get_nowait()
-                if uhsz_signal:
-                    await state['cat_analyzation_queue'].put((lores_frame, fullres_frame))
-            except asyncio.QueueEmpty:
-                pass  # No signal yet, continue
+            if keyframe and state['spool'] is not None and state['spool'].should_roll():
+                await self._queue_current_chunk(state)
+                print(f"Pipeline: {self._pipeline_stats(state)}")
+
+            if state['spool'] is None:
+                if not keyframe:
+                    continue
+                # Creating the spool touches the disk, keep it off the loop
+                state['spool'] = await asyncio.to_thread(self._start_chunk_spool, state)
+            state['spool'].write(fullres_frame, keyframe)
+
+    def _chunk_file_name(self, state, chunk_number):
+        return chunk_file_name(state['vs'], chunk_number, encoder_extension(state['vs'].encoder_profile))
+
+    def _start_chunk_spool(self, state):
+        """Frames are journaled to disk first, the save worker encodes them once the chunk is complete"""
+        chunk_number = state['current_chunk_number']
+        return ChunkSpool.create(
+            state['vs'],
+            chunk_number,
+            self._chunk_file_name(state, chunk_number),
+            profile=state['vs'].encoder_profile,
+            framerate=state['source'].framerate,
+            width=state['source'].width,
+            height=state['source'].height,
+            max_duration=settings.RECORDING_CHUNK_DURATION,
+            max_bytes=settings.RECORDING_SPOOL_MAX_BYTES,
+            queue_size=settings.PIPELINE_QUEUES['spool_frames'],
+        )
+
+    def _pipeline_stats(self, state):
+        """Depth and drop counters of every stage"""
+        worker = state['inference_worker']
+        return {
+            'fullres_bus': state['fullres_bus'].stats(),
+            'lores_bus': state['lores_bus'].stats(),
+            'detection': state['cat_analyzation_queue'].stats(),
+            'inference': worker.stats() if worker is not None else None,
+            'uhsz': state['uhsz_queue'].stats(),
+            'chunks': {'depth': state['queue'].qsize()},
+            'viewers': get_viewer_hub().stats(),
+        }
+
+    async def _queue_current_chunk(self, state):
+        """Hand the current spool over to the save worker and start counting a new chunk"""
+        cat_detections = state['cat_detections_in_current_chunk']
+        state['cat_detections_in_current_chunk'] = []
+        await state['queue'].put((state['spool'], cat_detections))
+        print(f"Queued chunk {state['current_chunk_number']} with {state['spool'].frame_count} frames, {state['spool'].dropped} dropped")
+        state['current_chunk_number'] += 1
+        state['spool'] = None
+
+    async def _broadcast_frames(self):
+        """Hand low-res frames to the viewers, each client takes the newest one when it's ready"""
+        state = _recording_state
+        if not state:
+            return
+        hub = get_viewer_hub()
+        cursor = state['lores_bus'].subscribe('broadcaster')
+        while True:
+            lores_frame = await cursor.next()
+            if lores_frame is None:
+                break
+            hub.publish(lores_frame)
+
+    def _detect_motion(self, luma):
+        """Called by the frame source on its own thread for every lores frame"""
+        state = _recording_state
+        if not state:
+            return
+        state['motion'].update(luma)
 
-            await asyncio.sleep(0.033)  # ~30fps
+    def _should_analyze(self, state):
+        """Combine the distance sensor and motion signals according to CAT_DETECTION_TRIGGER"""
+        try:
+            uhsz = bool(state['uhsz_queue'].get_nowait())
+        except asyncio.QueueEmpty:
+            uhsz = False  # No signal yet, continue
+        motion = state['motion'] is not None and state['motion'].moved_within(settings.MOTION_TRIGGER_WINDOW)
+
+        trigger = state['trigger']
+        if trigger == 'uhsz':
+            fire = uhsz
+        elif trigger == 'motion':
+            fire = motion
+        elif trigger == 'uhsz_and_motion':
+            fire = uhsz and motion
+        else:  # 'uhsz_or_motion'
+            fire = uhsz or motion
+
+        now = time.monotonic()
+        if fire and now - state['last_trigger'] >= settings.CAT_DETECTION_COOLDOWN:
+            state['last_trigger'] = now
+            return True
+        return False
+
+    async def _trigger_cat_analyzation(self):
+        """Pass the current frame pair to the detector whenever the distance sensor or motion fires"""
+        state = _recording_state
+        if not state:
+            return
+        cursor = state['lores_bus'].subscribe('detector')
+        while True:
+            lores_frame = await cursor.next()
+            if lores_frame is None:
+                break
+            # There are no full-res JPEGs when recording H.264, keep the preview frame instead
+            fullres_frame = lores_frame if state['stream_copy'] else state['fullres_bus'].latest()
+            if self._should_analyze(state) and fullres_frame:
+                raw_lores = None
+                if settings.CAT_DETECTOR_INPUT == 'raw':
+                    # Taken now, so the boxes belong to the frames that fired the trigger
+                    try:
+                        raw_lores = state['source'].latest_lores()
+                    except Exception as e:
+                        print(f"Couldn't get lores array, using the JPEG: {e}")
+                await state['cat_analyzation_queue'].put((lores_frame, fullres_frame, raw_lores))
     
     async def _cat_analyzation(self):
+        """Hand frames to the inference worker, results are saved as they come back"""
         state = _recording_state
         if not state:
             return
-        
-        while True:
-            try:
-                lores_frame, fullres_frame = await state['cat_analyzation_queue'].get()
-                if lores_frame is None or fullres_frame is None:
-                    break
-                print("analyzing for cats...")
-                image = Image.open(io.BytesIO(lores_frame)).convert('RGB')
-                img_tensor = self.transform(image).unsqueeze(0).to(self.device)
-                with torch.no_grad():
-                    predictions = self.model(img_tensor)[0]
-                for i, label in enumerate(predictions['labels']):
-                    if label == self.CAT_CLASS_ID:
-                        score = predictions['scores'][i].item()
-                        if score >= self.confidence_threshold:
-                            cd = await database_sync_to_async(CatDetection.objects.create)(frame_num=len(state['frames']), frame_file=ContentFile(fullres_frame, f'{datetime.now().strftime("%Y_%m_%d_%H_%M_%S")}.jpg'), video_stream=state['vs'])
-                            state['cat_detections_in_current_chunk'].append(cd)
-            except Exception as e:
-                print(e)
 
+        worker = await asyncio.to_thread(get_inference_worker)
+        state['inference_worker'] = worker
+        pending = set()
 
-    async def stream_frame(self, event):
-        """Handler for receiving frames from group_send"""
+        while True:
+            item = await state['cat_analyzation_queue'].get()
+            if item is None:
+                break
+            lores_frame, fullres_frame, raw_lores = item
+            print("analyzing for cats...")
+            detector_input = lores_frame
+            if raw_lores is not None:
+                try:
+                    detector_input = await asyncio.to_thread(state['source'].lores_to_rgb, raw_lores)
+                except Exception as e:
+                    print(f"Couldn't convert lores array, using the JPEG: {e}")
+            predictions = asyncio.wrap_future(worker.submit(detector_input))
+            frame_num = state['spool'].frame_count if state['spool'] is not None else 0
+            task = asyncio.create_task(self._save_cat_detections(state, predictions, lores_frame, fullres_frame, frame_num))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+
+        if pending:
+            # Frames the worker dropped end up as cancelled tasks
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _save_cat_detections(self, state, predictions, lores_frame, fullres_frame, frame_num):
         try:
-            await self.send(bytes_data=event['frame'])
-        except:
-            # Client disconnected
-            pass
+            detector = get_detector()
+            boxes = detector.cat_boxes(await predictions)
+            print(f"Detector latency (ms): {detector.latency_stats()}, cascade: {detector.cascade_stats()}")
+            if not boxes:
+                return
+            # Boxes are kept in lores pixels, box_scale maps them onto the stored frame
+            box_scale = frame_size(fullres_frame)[0] / frame_size(lores_frame)[0]
+            boxes = [[round(c, 1) for c in box[:4]] + [round(box[4], 3)] for box in boxes]
+            cd = await database_sync_to_async(CatDetection.objects.create)(frame_num=frame_num, frame_file=ContentFile(fullres_frame, f'{datetime.now().strftime("%Y_%m_%d_%H_%M_%S")}.jpg'), video_stream=state['vs'], boxes=boxes, box_scale=box_scale)
+            state['cat_detections_in_current_chunk'].append(cd)
+            derivatives = await asyncio.to_thread(make_derivatives, fullres_frame, cd.best_box)
+            await database_sync_to_async(cd.attach_derivatives)(derivatives)
+        except Exception as e:
+            print(e)
+
 
     async def _worker_save_chunk(self):
-        """Convert frames to WebM and save to database"""
+        """Encode each spooled chunk and save it to the database"""
         state = _recording_state
         if not state:
             return
             
         while True:
-            frames, current_chunk_number, cat_detections_in_current_chunk = await state['queue'].get()
+            spool, cat_detections_in_current_chunk = await state['queue'].get()
 
-            if frames is None:
+            if spool is None:
                 break
 
-            print(f"Converting chunk {current_chunk_number} with {len(frames)} frames...")
+            current_chunk_number = spool.chunk_number
+            print(f"Encoding chunk {current_chunk_number} with {spool.frame_count} frames...")
             
             try:
-                buffer = await asyncio.to_thread(
-                    frames_to_webm_buffer, 
-                    frames, 
-                    framerate=30,
-                    width=1920,
-                    height=1080
-                )
-                
-                chunk = await database_sync_to_async(Chunk.objects.create)(
-                    video_stream=state['vs'], 
-                    chunk_number=current_chunk_number
-                )
-                await database_sync_to_async(chunk.video_file.save)(
-                    f'CHUNK_{current_chunk_number:04d}.webm', 
-                    ContentFile(buffer.getvalue()),
-                    save=True
-                )
+                await asyncio.to_thread(spool.seal)
+                encoder = await asyncio.to_thread(spool.encode)
+                chunk = await database_sync_to_async(register_chunk)(state['vs'], spool, encoder)
 
                 for cd in cat_detections_in_current_chunk:
                     cd.chunk = chunk
                     await database_sync_to_async(cd.save)()
-                    _recording_state['cat_detections_in_current_chunk'] = []
-                
+
+                # Only now the frames aren't needed for recovery anymore
+                await asyncio.to_thread(spool.remove)
                 print(f"Saved chunk {current_chunk_number}")
                 
             except Exception as e:
+                # The spool stays on disk, recovery retries it on the next start
                 print(f"Error saving chunk {current_chunk_number}: {e}")
 
-    async def _video_combination_task(self):
-        while True:
-            await asyncio.sleep(300)  # Every 5 minutes
-            async with _recording_lock:
-                global _recording_state
-                if _recording_state is None:
-                    break
-                
-                state = _recording_state
-                chunks = await database_sync_to_async(list)(Chunk.objects.filter(video_stream=state['vs']).order_by('chunk_number'))
-                
-                chunk_paths = [chunk.video_file.path for chunk in chunks]
-                try:
-                    buffer = await asyncio.to_thread(
-                        concatenate_webm_chunks,
-                        chunk_paths
-                    )
-                    
-                    combined_video_path = f'combined_{state["vs"].id}.webm'
-                    with open(combined_video_path, 'wb') as f:
-                        f.write(buffer.getvalue())
-                    
-                    print(f"Combined video saved to {combined_video_path}")
-                    
-                except Exception as e:
-                    print(f"Error combining videos: {e}")
+    async def _combine_stream(self, vs):
+        """Build one combined file from the stream's manifest"""
+        try:
+            chunk_paths = [os.path.join(settings.MEDIA_ROOT, entry['file']) for entry in read_manifest(vs)]
+            if not chunk_paths:
+                return
+            combined_video_path = os.path.join(settings.MEDIA_ROOT, combined_file_name(vs, encoder_extension(vs.encoder_profile)))
+            await asyncio.to_thread(concatenate_chunks, chunk_paths, combined_video_path)
+            print(f"Combined video saved to {combined_video_path}")
+        except Exception as e:
+            print(f"Error combining videos: {e}")
 
     async def _use_uhsz(self):
-        TRIG = 23
-        ECHO = 24
-
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(TRIG, GPIO.OUT)
-        GPIO.setup(ECHO, GPIO.IN)
-
-        GPIO.output(TRIG, False)
-        time.sleep(2)
-
-        def get_distance():
-            # Trigger pulse
-            GPIO.output(TRIG, True)
-            time.sleep(0.00001)
-            GPIO.output(TRIG, False)
-
-            # Echo start
-            while GPIO.input(ECHO) == 0:
-                pulse_start = time.time()
-
-            # Echo end
-            while GPIO.input(ECHO) == 1:
-                pulse_end = time.time()
-
-            pulse_duration = pulse_end - pulse_start
-
-            distance = pulse_duration * 17150  # cm
-            distance = round(distance, 1)
-
-            return distance
-
-        def filter_outliers(samples, max_deviation=30):
-            """Remove outliers that differ significantly from median"""
-            print(samples.__str__())
-            median = sorted(samples)[len(samples) // 2]
-            filtered = [x for x in samples if abs(x - median) <= max_deviation]
-            return filtered if filtered else samples
-    
-        last_distance = 0
-        start_time = time.time()
-        samples = []
+        """Turn the sensor's averaged distances into detection triggers"""
         state = _recording_state
-
         if not state:
             return
 
+        distances = state['uhsz_distances']
+        sensor = get_distance_source()
+        sensor.start(asyncio.get_running_loop(), distances.put_nowait)
+
+        last_distance = 0
         try:
             while True:
-                await asyncio.sleep(0.1)
-                try:
-                    distance = get_distance()
-                    if distance is not None and distance < 800:
-                        samples.append(distance)
-
-                    if time.time() - start_time >= 1.0:
-                        if len(samples) > 0:
-                            # Filter outliers before averaging
-                            filtered_samples = filter_outliers(samples, max_deviation=10)
-
-                            if len(filtered_samples) > 0:
-                                avg_distance = sum(filtered_samples) / len(filtered_samples)
-                                avg_distance = round(avg_distance, 1)
-
-                                if abs(last_distance - avg_distance) >= 5:
-                                    print(f"Átlagolt távolság: {avg_distance} cm (outliers szűrve: {len(samples) - len(filtered_samples)})")
-                                    last_distance = avg_distance
-                                    await _recording_state['uhsz_queue'].put(True)
-                            else:
-                                print("Minden érték outlier volt")
-
-                        samples = []
-                        start_time = time.time()
-
-                except Exception as e:
-                    print(f"Hiba: {e}")
-
-                if state['signal_to_stop'] == 1:
-                    break
+                distance = await distances.get()
+                if abs(last_distance - distance) >= 5:
+                    print(f"Átlagolt távolság: {distance} cm")
+                    last_distance = distance
+                    await state['uhsz_queue'].put(True)
         finally:
-            GPIO.cleanup()
\ No newline at end of file
+            await asyncio.to_thread(sensor.stop)
@@ -2,15 +2,12 @@ from channels.generic.websocket import AsyncWebsocketConsumer
 import json
 from datetime import datetime
 import os
-from stream.models import VideoStream, Chunk
-from django.core.files.base import ContentFile
+from stream.models import VideoStream, Chunk, chunk_file_name
+from stream.files import write_file_atomic
+from stream.manifest import append_to_manifest
+from django.conf import settings
 import asyncio
 from channels.db import database_sync_to_async
-import io
-
-from picamera2 import Picamera2
-from picamera2.encoders import MJPEGEncoder
-from picamera2.outputs import FileOutput, FfmpegOutput, PyavOutput
 
 
 
@@ -54,7 +51,7 @@ class PhoneStreamConsumer(AsyncWebsocketConsumer):
         await self.worker_task
         if self.vs is not None:
             self.vs.stopped = datetime.now()
-        await database_sync_to_async(self.vs.save)()
+        await database_sync_to_async(self.vs.save)(update_fields=['stopped'])
 
     async def _worker_save_chunk(self):
         while True:
@@ -63,5 +60,7 @@ class PhoneStreamConsumer(AsyncWebsocketConsumer):
             if buffer is None:
                 break
 
-            chunk = await database_sync_to_async(Chunk.objects.create)(video_stream=self.vs, chunk_number=current_chunk_number)
-            await database_sync_to_async(chunk.video_file.save)(f'CHUNK_{current_chunk_number:04d}.webm', ContentFile(buffer), save=True)
\ No newline at end of file
+            name = chunk_file_name(self.vs, current_chunk_number)
+            await asyncio.to_thread(write_file_atomic, os.path.join(settings.MEDIA_ROOT, name), buffer)
+            chunk = await database_sync_to_async(Chunk.objects.create)(video_stream=self.vs, chunk_number=current_chunk_number, video_file=name)
+            await asyncio.to_thread(append_to_manifest, chunk)
\ No newline at end of file
@@ -0,0 +1,261 @@
+import collections
+import concurrent.futures
+import io
+import queue
+import threading
+import time
+
+from django.conf import settings
+import numpy as np
+import torch
+import torch.nn.functional as F
+import torchvision
+from torchvision import transforms
+from PIL import Image
+
+from stream.detector_backends import load_backend
+
+
+CAT_CLASS_ID = 17
+IMAGENET_CAT_CLASSES = slice(281, 286)  # tabby, tiger cat, Persian, Siamese, Egyptian cat
+
+_detector = None
+_detector_lock = threading.Lock()
+_inference_worker = None
+
+
+class CatGate:
+    """
+    First tier of the cascade: a MobileNetV3-Small ImageNet classifier on a
+    downscaled frame, only answering "could there be a cat at all".
+    """
+
+    def __init__(self, threshold=0.05, size=224, device='cpu'):
+        self.threshold = threshold
+        self.size = size
+        self.model = torchvision.models.mobilenet_v3_small(weights='DEFAULT')
+        self.model.to(device)
+        self.model.eval()
+        self.mean = torch.tensor([0.485, 0.456, 0.406], device=device).view(1, 3, 1, 1)
+        self.std = torch.tensor([0.229, 0.224, 0.225], device=device).view(1, 3, 1, 1)
+
+    def scores(self, tensors):
+        """Summed probability of the ImageNet cat classes for each (3, H, W) tensor"""
+        batch = torch.cat([
+            F.interpolate(t.unsqueeze(0), size=(self.size, self.size), mode='bilinear', align_corners=False)
+            for t in tensors
+        ])
+        logits = self.model((batch - self.mean) / self.std)
+        return logits.softmax(dim=1)[:, IMAGENET_CAT_CLASSES].sum(dim=1).tolist()
+
+
+class CatDetector:
+    """Faster R-CNN cat detector, one instance shared by the whole process"""
+
+    def __init__(self, backend='eager', device='cpu', confidence_threshold=0.5, gate=None):
+        self.device = device
+        self.confidence_threshold = confidence_threshold
+
+        self.backend = load_backend(backend, device)
+        self.gate = gate
+        self.latencies = collections.deque(maxlen=500)  # seconds per frame
+        # Per tier: frames that reached it and frames it passed on (or found a cat in)
+        self.tier_counts = {'gate': [0, 0], 'detector': [0, 0]}
+
+        self.transform = transforms.Compose([
+            transforms.ToTensor(),
+        ])
+
+    def warmup(self, width=960, height=540):
+        """Run one dummy pass so the first real frame doesn't pay for lazy init"""
+        with torch.no_grad():
+            self.backend([torch.zeros(3, height, width, device=self.device)])
+            if self.gate is not None:
+                self.gate.scores([torch.zeros(3, height, width, device=self.device)])
+
+    def latency_stats(self):
+        """p50/p95/p99 of the recent per-frame latencies, in milliseconds"""
+        if not self.latencies:
+            return {}
+        latencies = sorted(self.latencies)
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 1)
+        return {'backend': self.backend.name, 'frames': len(latencies), 'p50': percentile(0.5), 'p95': percentile(0.95), 'p99': percentile(0.99)}
+
+    def cascade_stats(self):
+        """How many frames each tier saw and what fraction it let through / found cats in"""
+        return {
+            tier: {'frames': seen, 'hit_rate': round(hits / seen, 3) if seen else None}
+            for tier, (seen, hits) in self.tier_counts.items()
+        }
+
+    def prepare(self, frame):
+        """Turn a JPEG frame, a float RGB (H, W, 3) array or a PIL image into an input tensor"""
+        if isinstance(frame, np.ndarray):
+            # Shares the array's memory, no copy until the model reads it
+            return torch.from_numpy(frame).permute(2, 0, 1).to(self.device)
+        if isinstance(frame, (bytes, bytearray, memoryview)):
+            frame = Image.open(io.BytesIO(frame)).convert('RGB')
+        return self.transform(frame).to(self.device)
+
+    def predict_batch(self, frames):
+        """Run a single forward pass over several frames, one prediction dict per frame"""
+        tensors = [self.prepare(frame) for frame in frames]
+        predictions = [None] * len(tensors)
+        with torch.no_grad():
+            selected = list(range(len(tensors)))
+            if self.gate is not None:
+                gate_scores = self.gate.scores(tensors)
+                selected = [i for i, score in enumerate(gate_scores) if score >= self.gate.threshold]
+                self.tier_counts['gate'][0] += len(tensors)
+                self.tier_counts['gate'][1] += len(selected)
+
+            if selected:
+                started = time.perf_counter()
+                for i, p in zip(selected, self.backend([tensors[i] for i in selected])):
+                    predictions[i] = p
+                per_frame = (time.perf_counter() - started) / len(selected)
+                self.latencies.extend([per_frame] * len(selected))
+                self.tier_counts['detector'][0] += len(selected)
+                self.tier_counts['detector'][1] += sum(1 for i in selected if self.cat_boxes(predictions[i]))
+
+        # Frames the gate rejected get an empty result
+        return [p if p is not None else empty_predictions() for p in predictions]
+
+    def predict(self, frame):
+        """Run the model on one frame and return its raw predictions"""
+        return self.predict_batch([frame])[0]
+
+    def cat_boxes(self, predictions):
+        """[x1, y1, x2, y2, score] of the cat boxes that pass the confidence threshold, in input pixels"""
+        boxes = []
+        for i, label in enumerate(predictions['labels']):
+            if label == CAT_CLASS_ID:
+                score = predictions['scores'][i].item()
+                if score >= self.confidence_threshold:
+                    boxes.append([*predictions['boxes'][i].tolist(), score])
+        return boxes
+
+    def cat_scores(self, predictions):
+        """Scores of the cat boxes that pass the confidence threshold"""
+        return [box[4] for box in self.cat_boxes(predictions)]
+
+
+def empty_predictions():
+    return {
+        'boxes': torch.zeros((0, 4)),
+        'labels': torch.zeros((0,), dtype=torch.int64),
+        'scores': torch.zeros((0,)),
+    }
+
+
+class InferenceWorker:
+    """Runs the detector on its own thread, batching whatever frames are pending"""
+
+    def __init__(self, detector, max_batch_size=4, batch_deadline=0.05, max_pending=0):
+        self.detector = detector
+        self.max_batch_size = max_batch_size
+        self.batch_deadline = batch_deadline
+        self.requests = queue.Queue(max_pending)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, name='cat-inference', daemon=True)
+        self.thread.start()
+
+    def submit(self, frame):
+        """
+        Queue a frame for inference, returns a concurrent.futures.Future of its predictions.
+
+        When max_pending frames are already waiting the oldest one is cancelled,
+        a stale frame isn't worth delaying the new one for.
+        """
+        future = concurrent.futures.Future()
+        while True:
+            try:
+                self.requests.put_nowait((frame, future))
+                return future
+            except queue.Full:
+                try:
+                    _, oldest = self.requests.get_nowait()
+                except queue.Empty:
+                    continue  # The worker just took it
+                oldest.cancel()
+                self.dropped += 1
+
+    def stats(self):
+        return {'depth': self.requests.qsize(), 'max': self.requests.maxsize, 'dropped': self.dropped}
+
+    def _collect_batch(self):
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.batch_deadline
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return [(frame, future) for frame, future in batch if future.set_running_or_notify_cancel()]
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if not batch:
+                continue
+            try:
+                results = self.detector.predict_batch([frame for frame, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), predictions in zip(batch, results):
+                future.set_result(predictions)
+
+
+def build_detector():
+    """New warmed up detector as configured in settings"""
+    gate = None
+    if settings.CAT_GATE['enabled']:
+        gate = CatGate(threshold=settings.CAT_GATE['threshold'], size=settings.CAT_GATE['size'])
+    detector = CatDetector(
+        backend=settings.CAT_DETECTOR_BACKEND,
+        confidence_threshold=settings.CAT_DETECTOR_CONFIDENCE,
+        gate=gate,
+    )
+    detector.warmup()
+    return detector
+
+
+def get_detector():
+    """Return the process-wide detector, loading it on first use"""
+    global _detector
+    if _detector is None:
+        with _detector_lock:
+            if _detector is None:
+                print("Loading cat detector...")
+                _detector = build_detector()
+                print("Cat detector ready")
+    return _detector
+
+
+def preload_detector():
+    """Load and warm up the detector in the background so the first START doesn't wait for it"""
+    thread = threading.Thread(target=get_detector, name='cat-detector-preload', daemon=True)
+    thread.start()
+    return thread
+
+
+def get_inference_worker():
+    """Return the process-wide inference worker, starting it on first use"""
+    global _inference_worker
+    detector = get_detector()
+    if _inference_worker is None:
+        with _detector_lock:
+            if _inference_worker is None:
+                _inference_worker = InferenceWorker(
+                    detector,
+                    max_batch_size=settings.CAT_DETECTOR_BATCH_SIZE,
+                    batch_deadline=settings.CAT_DETECTOR_BATCH_DEADLINE,
+                    max_pending=settings.PIPELINE_QUEUES['inference'],
+                )
+    return _inference_worker
@@ -0,0 +1,113 @@
+import os
+
+from django.conf import settings
+import torch
+import torchvision
+
+
+def build_eager_model(device='cpu'):
+    """Stock fp32 fasterrcnn_mobilenet_v3_large_fpn in eval mode"""
+    model = torchvision.models.detection.fasterrcnn_mobilenet_v3_large_fpn(
+        pretrained=True
+    )
+    model.to(device)
+    model.eval()
+    return model
+
+
+def cached_model_path(backend):
+    """Where export_detector stores the optimised model of a backend"""
+    return os.path.join(settings.CAT_DETECTOR_MODEL_DIR, BACKENDS[backend].filename)
+
+
+class EagerBackend:
+    name = 'eager'
+    filename = None
+
+    def __init__(self, device='cpu'):
+        self.model = build_eager_model(device)
+
+    def __call__(self, tensors):
+        return self.model(tensors)
+
+
+class TorchScriptBackend:
+    name = 'torchscript'
+    filename = 'fasterrcnn_scripted.pt'
+
+    def __init__(self, device='cpu'):
+        self.model = torch.jit.load(cached_model_path(self.name), map_location=device)
+        self.model.eval()
+
+    def __call__(self, tensors):
+        # Scripted detection models return (losses, detections)
+        return self.model(tensors)[1]
+
+    @staticmethod
+    def export(model, path):
+        torch.jit.save(torch.jit.script(model), path)
+
+
+class QuantizedBackend:
+    """int8 dynamic quantisation of the Linear layers (the box head), conv layers stay fp32"""
+    name = 'quantized'
+    filename = 'fasterrcnn_quantized.pt'
+
+    def __init__(self, device='cpu'):
+        self.model = torch.load(cached_model_path(self.name), map_location=device, weights_only=False)
+        self.model.eval()
+
+    def __call__(self, tensors):
+        return self.model(tensors)
+
+    @staticmethod
+    def export(model, path):
+        quantized = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        torch.save(quantized, path)
+
+
+class OnnxBackend:
+    """ONNX Runtime on CPU, the exported graph takes one image per run"""
+    name = 'onnx'
+    filename = 'fasterrcnn.onnx'
+
+    def __init__(self, device='cpu'):
+        import onnxruntime
+        self.session = onnxruntime.InferenceSession(cached_model_path(self.name), providers=['CPUExecutionProvider'])
+
+    def __call__(self, tensors):
+        results = []
+        for tensor in tensors:
+            boxes, labels, scores = self.session.run(None, {'images': tensor.contiguous().numpy()})
+            results.append({
+                'boxes': torch.from_numpy(boxes),
+                'labels': torch.from_numpy(labels),
+                'scores': torch.from_numpy(scores),
+            })
+        return results
+
+    @staticmethod
+    def export(model, path, width=960, height=540):
+        torch.onnx.export(
+            model,
+            ([torch.rand(3, height, width)],),
+            path,
+            opset_version=11,
+            input_names=['images'],
+            output_names=['boxes', 'labels', 'scores'],
+            dynamic_axes={'images': [1, 2], 'boxes': [0], 'labels': [0], 'scores': [0]},
+        )
+
+
+BACKENDS = {backend.name: backend for backend in (EagerBackend, TorchScriptBackend, QuantizedBackend, OnnxBackend)}
+
+
+def load_backend(name, device='cpu'):
+    """Instantiate a backend, falling back to eager if its exported model can't be loaded"""
+    try:
+        return BACKENDS[name](device)
+    except Exception as e:
+        if name == EagerBackend.name:
+            raise
+        print(f"Couldn't load the {name} detector backend ({e}), using eager")
+        return EagerBackend(device)
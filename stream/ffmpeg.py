@@ -1,8 +1,215 @@
 import subprocess
 import threading
 import io
-def frames_to_webm_buffer(frames, framerate=30, width=None, height=None):
-    """Convert list of JPEG frames to WebM buffer"""
+import os
+import queue
+import tempfile
+import time
+
+from stream.files import part_path, commit_part, discard_part
+
+
+ENCODER_PROFILES = {
+    # Original settings, best quality but far slower than realtime on a Pi
+    'vp8_good': {
+        'extension': 'webm',
+        'args': [
+            '-c:v', 'libvpx',  # VP8
+            '-b:v', '5M',  # 5 Mbps bitrate for better quality
+            '-quality', 'good',  # Better quality than realtime
+            '-cpu-used', '2',  # Slower but better quality (0-5, lower is better)
+            '-auto-alt-ref', '1',  # Enable alternate reference frames
+            '-lag-in-frames', '25',  # Look ahead frames
+            '-f', 'webm',
+        ],
+    },
+    'vp8_realtime': {
+        'extension': 'webm',
+        'args': [
+            '-c:v', 'libvpx',
+            '-b:v', '5M',
+            '-deadline', 'realtime',
+            '-cpu-used', '8',  # Fastest realtime speed setting
+            '-lag-in-frames', '0',
+            '-threads', '4',
+            '-f', 'webm',
+        ],
+    },
+    'vp9_realtime': {
+        'extension': 'webm',
+        'args': [
+            '-c:v', 'libvpx-vp9',
+            '-b:v', '4M',
+            '-deadline', 'realtime',
+            '-cpu-used', '8',
+            '-row-mt', '1',
+            '-lag-in-frames', '0',
+            '-f', 'webm',
+        ],
+    },
+    # No transcoding at all, the camera's JPEGs are just muxed (browsers can't play it)
+    'mjpeg_copy': {
+        'extension': 'mkv',
+        'scale': False,
+        'args': [
+            '-c:v', 'copy',
+            '-f', 'matroska',
+        ],
+    },
+    # The Pi's hardware H.264 encoder, same bitrate as stream/pyav.py
+    'h264': {
+        'extension': 'mp4',
+        'args': [
+            '-c:v', 'h264_v4l2m2m',
+            '-b:v', '10M',
+            '-pix_fmt', 'yuv420p',
+            '-f', 'mp4',
+        ],
+    },
+    # H.264 straight from picamera2's hardware encoder, only remuxed into fragmented MP4
+    'h264_copy': {
+        'extension': 'mp4',
+        'scale': False,
+        'input': ['-fflags', '+genpts', '-f', 'h264'],
+        'args': [
+            '-c:v', 'copy',
+            '-movflags', 'frag_keyframe+empty_moov+default_base_moof',
+            '-f', 'mp4',
+        ],
+    },
+}
+DEFAULT_ENCODER_PROFILE = 'vp8_good'
+
+
+def encoder_output_args(profile, width, height):
+    """ffmpeg output options of an encoder profile"""
+    profile = ENCODER_PROFILES[profile]
+    args = []
+    if profile.get('scale', True):
+        args += [
+            '-s', f'{width}x{height}',  # Force output resolution
+            '-aspect', f'{width}:{height}',  # Set aspect ratio
+        ]
+    return args + profile['args']
+
+
+def encoder_input_args(profile):
+    """ffmpeg input options, JPEG frames unless the profile takes something else"""
+    return ENCODER_PROFILES[profile].get('input', ['-f', 'image2pipe', '-codec:v', 'mjpeg'])
+
+
+def encoder_extension(profile):
+    return ENCODER_PROFILES[profile]['extension']
+
+
+def is_stream_copy(profile):
+    """True for profiles fed with the camera's H.264 elementary stream"""
+    return 'input' in ENCODER_PROFILES[profile]
+
+
+class ChunkEncoder:
+    """
+    Long-lived ffmpeg process for one chunk.
+
+    Frames (JPEGs, or H.264 data for stream copy profiles) are written to
+    ffmpeg's stdin as they arrive (from a background thread, so write()
+    never blocks the caller). ffmpeg writes the encoded video to a temp
+    file next to output_path, which is renamed into place once the chunk
+    is closed.
+
+    With queue_size, write() blocks once that many frames are waiting,
+    for callers that can wait (encoding a spooled chunk).
+    """
+
+    def __init__(self, output_path, framerate=30, width=1920, height=1080, profile=DEFAULT_ENCODER_PROFILE, queue_size=0):
+        self.output_path = output_path
+        self.framerate = framerate
+        self.encode_speed = None
+        self.frame_count = 0
+        self.started = time.monotonic()
+
+        self.tmp_path = part_path(output_path)
+
+        ffmpeg_cmd = [
+            'ffmpeg', '-y', '-nostats', '-loglevel', 'error',
+            *encoder_input_args(profile),
+            '-framerate', str(framerate),
+            '-i', '-',
+            *encoder_output_args(profile, width, height),
+            self.tmp_path
+        ]
+        print(f"Running: {' '.join(ffmpeg_cmd)}")
+
+        self.stderr = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(
+            ffmpeg_cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=self.stderr
+        )
+
+        self.frames = queue.Queue(queue_size)
+        self.error = None
+        self.writer_thread = threading.Thread(target=self._write_frames, daemon=True)
+        self.writer_thread.start()
+
+    def _write_frames(self):
+        while True:
+            frame = self.frames.get()
+            if frame is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                self.process.stdin.write(frame)
+            except BrokenPipeError as e:
+                print("Broken pipe - FFmpeg crashed")
+                self.error = e
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+
+    def write(self, frame):
+        self.frames.put(frame)
+        self.frame_count += 1
+
+    @property
+    def duration(self):
+        return time.monotonic() - self.started
+
+    @property
+    def media_duration(self):
+        return self.frame_count / self.framerate
+
+    def close(self):
+        """Flush the remaining frames and wait for ffmpeg to finalise the file (blocking)"""
+        self.frames.put(None)
+        self.writer_thread.join()
+        self.process.wait()
+
+        # Seconds of video per second spent from the first frame until ffmpeg finished,
+        # anything below 1 means the profile can't keep up with capture
+        self.encode_speed = self.media_duration / self.duration
+
+        print(f"FFmpeg finished with return code: {self.process.returncode}, speed: {self.encode_speed:.2f}x")
+
+        self.stderr.seek(0)
+        stderr_data = self.stderr.read()
+        self.stderr.close()
+
+        if self.process.returncode != 0:
+            discard_part(self.tmp_path)
+            error_msg = stderr_data.decode() if stderr_data else "Unknown error"
+            print(f"FFmpeg stderr: {error_msg}")
+            raise Exception(f"FFmpeg error: {error_msg}")
+
+        print(f"Output size: {os.path.getsize(self.tmp_path)} bytes")
+        return commit_part(self.tmp_path, self.output_path)
+
+
+def frames_to_video_file(frames, output_path, framerate=30, width=None, height=None, profile=DEFAULT_ENCODER_PROFILE):
+    """Encode a list of JPEG frames into a video file at output_path, returns the encoder"""
     
     print(f"Starting conversion of {len(frames)} frames...")
     
@@ -15,105 +222,63 @@ def frames_to_webm_buffer(frames, framerate=30, width=None, height=None):
     
     print(f"Output resolution: {width}x{height}")
     
+    encoder = ChunkEncoder(output_path, framerate=framerate, width=width, height=height, profile=profile)
+    for frame in frames:
+        encoder.write(frame)
+    encoder.close()
+    return encoder
+
+CONTAINER_FORMATS = {
+    'webm': 'webm',
+    'mkv': 'matroska',
+    'mp4': 'mp4',
+}
+
+
+def concatenate_chunks(chunk_paths, output_path):
+    """
+    Join chunk files into output_path without re-encoding.
+
+    Uses ffmpeg's concat demuxer with stream copy, so the data is streamed
+    file to file and never held in memory.
+
+    Args:
+        chunk_paths: List of file paths (strings) to chunk files
+        output_path: Where the combined file ends up
+
+    Returns:
+        output_path
+    """
+    print(f"\nConcatenating {len(chunk_paths)} files into {output_path}...")
+
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as list_file:
+        for path in chunk_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            list_file.write(f"file '{escaped}'\n")
+
+    tmp_path = part_path(output_path)
+    extension = os.path.splitext(output_path)[1].lstrip('.')
     ffmpeg_cmd = [
-        'ffmpeg', '-y',
-        '-f', 'image2pipe',
-        '-codec:v', 'mjpeg',
-        '-framerate', str(framerate),
-        '-i', '-',
-        '-c:v', 'libvpx',  # VP8
-        '-b:v', '5M',  # 5 Mbps bitrate for better quality
-        '-quality', 'good',  # Better quality than realtime
-        '-cpu-used', '2',  # Slower but better quality (0-5, lower is better)
-        '-s', f'{width}x{height}',  # Force output resolution
-        '-aspect', f'{width}:{height}',  # Set aspect ratio
-        '-auto-alt-ref', '1',  # Enable alternate reference frames
-        '-lag-in-frames', '25',  # Look ahead frames
-        '-f', 'webm',
-        'pipe:1'
+        'ffmpeg', '-y', '-nostats', '-loglevel', 'error',
+        '-f', 'concat',
+        '-safe', '0',
+        '-i', list_file.name,
+        '-c', 'copy',
+        '-f', CONTAINER_FORMATS[extension],
+        tmp_path
     ]
-    
     print(f"Running: {' '.join(ffmpeg_cmd)}")
-    
-    process = subprocess.Popen(
-        ffmpeg_cmd,
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE
-    )
-    
-    # Read stdout in a separate thread to prevent buffer deadlock
-    output_data = []
-    
-    def read_output():
-        while True:
-            chunk = process.stdout.read(4096)
-            if not chunk:
-                break
-            output_data.append(chunk)
-    
-    reader_thread = threading.Thread(target=read_output)
-    reader_thread.start()
-    
-    # Write frames to stdin
+
     try:
-        for i, frame in enumerate(frames):
-            process.stdin.write(frame)
-            if i % 50 == 0:
-                print(f"Wrote frame {i}/{len(frames)}")
-        
-        process.stdin.close()
-        print("Closed stdin, waiting for output...")
-        
-    except BrokenPipeError:
-        print("Broken pipe - FFmpeg crashed")
-        process.kill()
-        raise
-    
-    # Wait for reader thread and process
-    reader_thread.join()
-    stderr_data = process.stderr.read()
-    process.wait()
-    
-    print(f"FFmpeg finished with return code: {process.returncode}")
-    
+        process = subprocess.run(ffmpeg_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    finally:
+        os.remove(list_file.name)
+
     if process.returncode != 0:
-        error_msg = stderr_data.decode() if stderr_data else "Unknown error"
+        discard_part(tmp_path)
+        error_msg = process.stderr.decode() if process.stderr else "Unknown error"
         print(f"FFmpeg stderr: {error_msg}")
         raise Exception(f"FFmpeg error: {error_msg}")
-    
-    # Combine output chunks
-    webm_data = b''.join(output_data)
-    print(f"Output size: {len(webm_data)} bytes")
-    
-    buffer = io.BytesIO(webm_data)
-    buffer.seek(0)
-    
-    return buffer
 
-def concatenate_webm_chunks(webm_chunk_paths):
-    """
-    Concatenate multiple WebM files into a single buffer.
-    
-    Args:
-        webm_chunk_paths: List of file paths (strings) to WebM files
-    
-    Returns:
-        BytesIO buffer containing concatenated WebM
-    """
-    print(f"\nConcatenating {len(webm_chunk_paths)} WebM chunks...")
-    
-    combined_data = b''
-    
-    for i, file_path in enumerate(webm_chunk_paths):
-        # Open the file and read its contents
-        with open(file_path, 'rb') as f:
-            chunk_data = f.read()
-            combined_data += chunk_data
-            print(f"  Added chunk {i + 1}: {len(chunk_data)} bytes")
-    
-    print(f"Total concatenated size: {len(combined_data)} bytes")
-    
-    result_buffer = io.BytesIO(combined_data)
-    result_buffer.seek(0)
-    return result_buffer
+    print(f"Total concatenated size: {os.path.getsize(tmp_path)} bytes")
+    return commit_part(tmp_path, output_path)
@@ -0,0 +1,36 @@
+import os
+import tempfile
+
+
+def part_path(path):
+    """Unique temp path next to path, so the final rename stays on one filesystem"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=f'.{os.path.basename(path)}.', suffix='.part', dir=directory)
+    os.close(fd)
+    return tmp
+
+
+def commit_part(tmp, path):
+    """Atomically move a finished temp file into place"""
+    os.replace(tmp, path)
+    return path
+
+
+def discard_part(tmp):
+    try:
+        os.remove(tmp)
+    except FileNotFoundError:
+        pass
+
+
+def write_file_atomic(path, data):
+    """Write bytes to path via a temp file in the same directory"""
+    tmp = part_path(path)
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(data)
+    except Exception:
+        discard_part(tmp)
+        raise
+    return commit_part(tmp, path)
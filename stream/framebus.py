@@ -0,0 +1,80 @@
+import asyncio
+
+
+class FrameBus:
+    """Ring buffer of the newest frames, published from the camera thread and read by asyncio tasks"""
+
+    def __init__(self, loop, size=30):
+        self.loop = loop
+        self.size = size
+        self.frames = [None] * size
+        self.seq = 0  # number of frames published so far
+        self.closed = False
+        self.cursors = {}
+        self._new_frame = loop.create_future()
+
+    def publish_threadsafe(self, frame):
+        """Called from the encoder thread, never blocks"""
+        self.loop.call_soon_threadsafe(self.publish, frame)
+
+    def publish(self, frame):
+        if self.closed:
+            return
+        self.frames[self.seq % self.size] = frame
+        self.seq += 1
+        self._wake()
+
+    def close(self):
+        """Wake every reader, they get None once they caught up"""
+        self.closed = True
+        self._wake()
+
+    def _wake(self):
+        if not self._new_frame.done():
+            self._new_frame.set_result(None)
+        self._new_frame = self.loop.create_future()
+
+    def latest(self):
+        if self.seq == 0:
+            return None
+        return self.frames[(self.seq - 1) % self.size]
+
+    def subscribe(self, name):
+        cursor = FrameCursor(self, name)
+        self.cursors[name] = cursor
+        return cursor
+
+    def stats(self):
+        return {name: {'lag': c.lag, 'dropped': c.dropped} for name, c in self.cursors.items()}
+
+
+class FrameCursor:
+    """One reader's position in a FrameBus"""
+
+    def __init__(self, bus, name):
+        self.bus = bus
+        self.name = name
+        self.position = bus.seq
+        self.dropped = 0
+
+    @property
+    def lag(self):
+        """Frames published but not read yet"""
+        return self.bus.seq - self.position
+
+    async def next(self):
+        """Wait for the next frame, None when the bus is closed and drained"""
+        bus = self.bus
+        while self.position >= bus.seq:
+            if bus.closed:
+                return None
+            await asyncio.shield(bus._new_frame)
+
+        if self.lag > bus.size:
+            # Reader fell behind a whole ring, skip to the oldest frame still kept
+            self.dropped += self.lag - bus.size
+            self.position = bus.seq - bus.size
+
+        frame = bus.frames[self.position % bus.size]
+        self.position += 1
+        return frame
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from stream.models import CatDetection
+from stream.thumbnails import make_derivatives
+
+
+class Command(BaseCommand):
+    help = "Generate thumbnail and medium images for cat detections that don't have them yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None, help="Stop after this many detections")
+
+    def handle(self, *args, **options):
+        pending = CatDetection.objects.filter(thumbnail_file='').order_by('id')
+        if options['limit']:
+            pending = pending[:options['limit']]
+
+        done = 0
+        for cd in pending.iterator(chunk_size=100):
+            try:
+                with cd.frame_file.open('rb') as f:
+                    frame = f.read()
+                cd.attach_derivatives(make_derivatives(frame, cd.best_box))
+                done += 1
+            except Exception as e:
+                self.stderr.write(f"#{cd.id}: {e}")
+        self.stdout.write(f"Generated derivatives for {done} detections")
@@ -0,0 +1,295 @@
+import asyncio
+import datetime
+import glob
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+import numpy as np
+import simplejpeg
+
+from stream.ffmpeg import ENCODER_PROFILES, concatenate_chunks, encoder_extension, frames_to_video_file, is_stream_copy
+
+
+STAGES = ['encode', 'concat', 'detector', 'fanout', 'chunk_save']
+
+
+def percentiles(values):
+    """p50/p95/p99 and max of a list of seconds, in milliseconds"""
+    values = sorted(values)
+    if not values:
+        return {'count': 0, 'p50': None, 'p95': None, 'p99': None, 'max': None}
+
+    def percentile(p):
+        return round(values[min(len(values) - 1, int(len(values) * p))] * 1000, 2)
+    return {'count': len(values), 'p50': percentile(0.5), 'p95': percentile(0.95), 'p99': percentile(0.99), 'max': round(values[-1] * 1000, 2)}
+
+
+def synthetic_frames(count, width, height):
+    """JPEGs of a gradient with a moving square, so encoders see some motion but not noise"""
+    ys, xs = np.mgrid[0:height, 0:width]
+    background = np.stack([xs * 255 // width, ys * 255 // height, np.full_like(xs, 128)], axis=-1).astype(np.uint8)
+    size = height // 4
+    frames = []
+    for i in range(count):
+        pixels = background.copy()
+        x = (i * 8) % (width - size)
+        pixels[height // 3:height // 3 + size, x:x + size] = (240, 200, 40)
+        frames.append(simplejpeg.encode_jpeg(pixels, quality=85, colorspace='RGB', colorsubsampling='420'))
+    return frames
+
+
+class Command(BaseCommand):
+    help = "Benchmark the recording pipeline (encoding, concatenation, detection, fan-out, chunk saving) and write a JSON report"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES)
+        parser.add_argument('--profiles', nargs='+', default=[p for p in ENCODER_PROFILES if not is_stream_copy(p)], help="Encoder profiles to measure")
+        parser.add_argument('--images', help="Directory of JPEGs to use as frames, synthetic frames are used without it")
+        parser.add_argument('--frames', type=int, default=90, help="Frames per encode run")
+        parser.add_argument('--width', type=int, default=settings.FRAME_SOURCE.get('width', 1920))
+        parser.add_argument('--height', type=int, default=settings.FRAME_SOURCE.get('height', 1080))
+        parser.add_argument('--chunks', type=int, default=10, help="Chunks to concatenate and to save")
+        parser.add_argument('--detector-runs', type=int, default=20)
+        parser.add_argument('--viewers', type=int, nargs='+', default=[1, 5, 20], help="Viewer counts for the fan-out measurement")
+        parser.add_argument('--fanout-frames', type=int, default=150)
+        parser.add_argument('--slow-viewers', type=int, default=1, help="How many of the viewers acknowledge frames slowly")
+        parser.add_argument('--slow-ack-delay', type=float, default=0.5, help="Seconds a slow viewer takes per frame")
+        parser.add_argument('--output', help="Write the report here instead of stdout")
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.workdir = tempfile.mkdtemp(prefix='macske-bench-')
+        lores_size = tuple(settings.FRAME_SOURCE.get('lores_size', (960, 540)))
+        try:
+            self.frames = self.load_frames(options['images'], options['width'], options['height'])
+            self.lores_frames = self.load_frames(options['images'], *lores_size)
+
+            report = {
+                'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                'machine': {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()},
+                'frame_size': [options['width'], options['height']],
+                'lores_size': list(lores_size),
+                'results': {},
+            }
+            for stage in options['stages']:
+                self.stderr.write(f"Benchmarking {stage}...")
+                started = time.perf_counter()
+                try:
+                    result = getattr(self, f'bench_{stage}')()
+                except Exception as e:
+                    result = {'error': f"{type(e).__name__}: {e}"}
+                    self.stderr.write(f"  failed: {result['error']}")
+                result['seconds'] = round(time.perf_counter() - started, 2)
+                report['results'][stage] = result
+        finally:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stderr.write(f"Report written to {options['output']}")
+        else:
+            self.stdout.write(output)
+
+    def load_frames(self, images, width, height):
+        if images:
+            from stream.thumbnails import scaled_jpeg
+            paths = sorted(glob.glob(os.path.join(images, '*.jpg')))
+            frames = []
+            for path in paths:
+                with open(path, 'rb') as f:
+                    frames.append(scaled_jpeg(f.read(), max(width, height)))
+            return frames
+        return synthetic_frames(self.options['frames'], width, height)
+
+    def frame_at(self, frames, i):
+        return frames[i % len(frames)]
+
+    def bench_encode(self):
+        """Sustained frames/s of each profile over a whole chunk"""
+        frames = [self.frame_at(self.frames, i) for i in range(self.options['frames'])]
+        results = {}
+        for profile in self.options['profiles']:
+            path = os.path.join(self.workdir, f'encode_{profile}.{encoder_extension(profile)}')
+            try:
+                started = time.perf_counter()
+                encoder = frames_to_video_file(frames, path, width=self.options['width'], height=self.options['height'], profile=profile)
+                elapsed = time.perf_counter() - started
+            except Exception as e:
+                results[profile] = {'error': str(e)}
+                continue
+            results[profile] = {
+                'frames': len(frames),
+                'fps': round(len(frames) / elapsed, 2),
+                'encode_speed': round(encoder.encode_speed, 3),
+                'bytes': os.path.getsize(path),
+            }
+        return results
+
+    def bench_concat(self):
+        """concatenate_chunks throughput on copies of one encoded chunk"""
+        profile = settings.RECORDING_ENCODER_PROFILE
+        extension = encoder_extension(profile)
+        chunk = os.path.join(self.workdir, f'concat_0.{extension}')
+        frames_to_video_file(self.frames, chunk, width=self.options['width'], height=self.options['height'], profile=profile)
+        paths = [chunk]
+        for n in range(1, self.options['chunks']):
+            paths.append(os.path.join(self.workdir, f'concat_{n}.{extension}'))
+            shutil.copyfile(chunk, paths[-1])
+
+        total = sum(os.path.getsize(path) for path in paths)
+        started = time.perf_counter()
+        concatenate_chunks(paths, os.path.join(self.workdir, f'combined.{extension}'))
+        elapsed = time.perf_counter() - started
+        return {
+            'profile': profile,
+            'chunks': len(paths),
+            'bytes': total,
+            'mb_per_s': round(total / elapsed / 1e6, 2),
+        }
+
+    def bench_detector(self):
+        """Per-frame detector latency as configured, directly and through the batching worker"""
+        from stream.detector import InferenceWorker, build_detector
+        from stream.thumbnails import frame_size
+        runs = self.options['detector_runs']
+        frames = [simplejpeg.decode_jpeg(self.frame_at(self.lores_frames, i), colorspace='RGB').astype(np.float32) / 255 for i in range(runs)]
+
+        detector = build_detector()
+        detector.latencies.clear()
+        for frame in frames:
+            detector.predict(frame)
+        direct = detector.latency_stats()
+
+        # End to end through the worker, with frames arriving at the camera's rate
+        worker = InferenceWorker(detector, settings.CAT_DETECTOR_BATCH_SIZE, settings.CAT_DETECTOR_BATCH_DEADLINE)
+        interval = 1 / settings.FRAME_SOURCE.get('fps', 30)
+        futures = []
+        worker_latencies = []
+        for frame in frames:
+            started = time.perf_counter()
+            future = worker.submit(frame)
+            future.add_done_callback(lambda f, started=started: worker_latencies.append(time.perf_counter() - started))
+            futures.append(future)
+            time.sleep(interval)
+        for future in futures:
+            future.result()
+        return {
+            'backend': direct['backend'],
+            'frame_size': list(frame_size(self.lores_frames[0])),
+            'direct': direct,
+            'worker': percentiles(worker_latencies),
+            'cascade': detector.cascade_stats(),
+        }
+
+    def bench_fanout(self):
+        """Publish to delivery latency for N connected viewers, some of them deliberately slow"""
+        async def run_all():
+            # One event loop for every run, the viewer hub is process-wide
+            return {str(n): await self.fanout(n) for n in self.options['viewers']}
+        return asyncio.run(run_all())
+
+    async def fanout(self, viewers):
+        from channels.testing import WebsocketCommunicator
+        from stream.consumers_arpi import ArpiStreamConsumer
+        from stream.viewers import get_viewer_hub
+
+        hub = get_viewer_hub()
+        application = ArpiStreamConsumer.as_asgi()
+        communicators = [WebsocketCommunicator(application, '/stream/arpi/ws/') for _ in range(viewers)]
+        for communicator in communicators:
+            await communicator.connect()
+        # Viewers register in connect order, the first ones play the slow clients
+        slow = min(self.options['slow_viewers'], viewers)
+        hub_viewers = hub.viewers[-viewers:]
+        finished = asyncio.Event()
+
+        async def receive(communicator, ack_delay):
+            while not finished.is_set():
+                if await communicator.receive_nothing(timeout=0.05):
+                    continue
+                message = await communicator.receive_output()
+                if message['type'] == 'websocket.send' and message.get('bytes'):
+                    await asyncio.sleep(ack_delay)
+                    await communicator.send_to(text_data=json.dumps({'_meta_action': 'ACK'}))
+
+        receivers = [
+            asyncio.create_task(receive(c, self.options['slow_ack_delay'] if n < slow else 0))
+            for n, c in enumerate(communicators)
+        ]
+        count = self.options['fanout_frames']
+        interval = 1 / settings.FRAME_SOURCE.get('fps', 30)
+        for i in range(count):
+            hub.publish(self.frame_at(self.lores_frames, i))
+            await asyncio.sleep(interval)
+        await asyncio.sleep(0.5)
+        finished.set()
+        await asyncio.gather(*receivers)
+
+        result = {'frames': count}
+        for name, group in (('fast', hub_viewers[slow:]), ('slow', hub_viewers[:slow])):
+            if group:
+                result[name] = {
+                    'viewers': len(group),
+                    'delivered': sum(viewer.sent for viewer in group),
+                    'skipped': sum(viewer.skipped for viewer in group),
+                    'tiers': [viewer.tier for viewer in group],
+                    'latency': percentiles([delay for viewer in group for delay in viewer.delays]),
+                }
+        for communicator in communicators:
+            await communicator.disconnect()
+        return result
+
+    def bench_chunk_save(self):
+        """What the save worker spends per chunk: sealing and encoding the spool, then the database and manifest writes"""
+        from stream.models import VideoStream, chunk_file_name
+        from stream.spool import ChunkSpool, register_chunk
+
+        profile = settings.RECORDING_ENCODER_PROFILE
+        encode_latencies = []
+        db_latencies = []
+
+        class Rollback(Exception):
+            pass
+
+        # Spools and chunks go to a throwaway directory and the rows are rolled back
+        with override_settings(MEDIA_ROOT=self.workdir, RECORDING_SPOOL_DIR=os.path.join(self.workdir, 'spool')):
+            try:
+                with transaction.atomic():
+                    vs = VideoStream.objects.create(source=0, encoder_profile=profile)
+                    for n in range(self.options['chunks']):
+                        spool = ChunkSpool.create(
+                            vs, n, chunk_file_name(vs, n, encoder_extension(profile)), profile,
+                            framerate=settings.FRAME_SOURCE.get('fps', 30), width=self.options['width'], height=self.options['height'],
+                        )
+                        for frame in self.frames:
+                            spool.write(frame)
+
+                        started = time.perf_counter()
+                        spool.seal()
+                        encoder = spool.encode()
+                        encoded = time.perf_counter()
+                        register_chunk(vs, spool, encoder)
+                        spool.remove()
+                        saved = time.perf_counter()
+
+                        encode_latencies.append(encoded - started)
+                        db_latencies.append(saved - encoded)
+                    raise Rollback
+            except Rollback:
+                pass
+        return {
+            'profile': profile,
+            'frames_per_chunk': len(self.frames),
+            'encode': percentiles(encode_latencies),
+            'database': percentiles(db_latencies),
+        }
@@ -0,0 +1,70 @@
+import glob
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from PIL import Image
+import torch
+
+from stream.detector import CatDetector
+from stream.detector_backends import BACKENDS, EagerBackend, build_eager_model, cached_model_path
+
+
+class Command(BaseCommand):
+    help = "Export the cat detector for the torchscript/quantized/onnx backends and compare their latency"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backends', nargs='+', default=[b for b in BACKENDS if b != EagerBackend.name], choices=[b for b in BACKENDS if b != EagerBackend.name])
+        parser.add_argument('--images', help="Directory of JPEGs to measure on, random frames are used without it")
+        parser.add_argument('--runs', type=int, default=20, help="Frames per backend when no images are given")
+        parser.add_argument('--tolerance', type=float, default=0.05, help="Allowed cat score difference to the eager model")
+        parser.add_argument('--skip-export', action='store_true', help="Only benchmark the already exported models")
+
+    def handle(self, *args, **options):
+        os.makedirs(settings.CAT_DETECTOR_MODEL_DIR, exist_ok=True)
+
+        if not options['skip_export']:
+            for name in options['backends']:
+                path = cached_model_path(name)
+                self.stdout.write(f"Exporting {name} to {path}...")
+                try:
+                    # Every export gets a fresh model, quantisation and scripting must not see each other's changes
+                    BACKENDS[name].export(build_eager_model(), path)
+                except Exception as e:
+                    self.stderr.write(f"  failed: {e}")
+
+        frames = self.load_frames(options)
+
+        eager = CatDetector(backend=EagerBackend.name)
+        reference = self.run(eager, frames)
+        results = [(EagerBackend.name, eager.latency_stats(), 0.0)]
+
+        for name in options['backends']:
+            detector = CatDetector(backend=name)
+            if detector.backend.name != name:
+                continue  # load_backend fell back to eager
+            scores = self.run(detector, frames)
+            error = max((abs(self.best_score(a) - self.best_score(b)) for a, b in zip(reference, scores)), default=0.0)
+            results.append((name, detector.latency_stats(), error))
+
+        fastest = None
+        for name, stats, error in results:
+            ok = error <= options['tolerance']
+            self.stdout.write(f"{name:12} p50 {stats['p50']:8.1f} ms  p95 {stats['p95']:8.1f} ms  max cat score diff {error:.3f} {'ok' if ok else 'OUT OF TOLERANCE'}")
+            if ok and (fastest is None or stats['p50'] < fastest[1]['p50']):
+                fastest = (name, stats)
+        self.stdout.write(f"Fastest within tolerance: {fastest[0]} (set CAT_DETECTOR_BACKEND = '{fastest[0]}')")
+
+    def load_frames(self, options):
+        if options['images']:
+            paths = sorted(glob.glob(os.path.join(options['images'], '*.jpg')))
+            return [Image.open(path).convert('RGB') for path in paths]
+        return [torch.rand(540, 960, 3).numpy() for _ in range(options['runs'])]
+
+    def run(self, detector, frames):
+        detector.warmup()
+        detector.latencies.clear()
+        return [detector.cat_scores(detector.predict(frame)) for frame in frames]
+
+    def best_score(self, scores):
+        return max(scores, default=0.0)
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from stream.spool import recover_recordings
+
+
+class Command(BaseCommand):
+    help = "Encode and register chunks left in the spool by a crash, and close streams that were never stopped"
+
+    def handle(self, *args, **options):
+        recover_recordings()
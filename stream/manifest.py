@@ -0,0 +1,35 @@
+import json
+import os
+
+from django.conf import settings
+
+from stream.models import Chunk, video_upload_path
+
+
+def manifest_file_name(video_stream):
+    """Storage name of the stream's chunk index, next to its chunks"""
+    return video_upload_path(Chunk(video_stream=video_stream), 'manifest.jsonl')
+
+
+def append_to_manifest(chunk, duration=None):
+    """Append one chunk to its stream's manifest, one JSON line per chunk so saving a chunk stays O(1)"""
+    path = os.path.join(settings.MEDIA_ROOT, manifest_file_name(chunk.video_stream))
+    entry = {
+        'chunk_number': chunk.chunk_number,
+        'file': chunk.video_file.name,
+        'duration': duration,
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+
+
+def read_manifest(video_stream):
+    """Manifest entries in chunk order, empty if nothing was saved yet"""
+    path = os.path.join(settings.MEDIA_ROOT, manifest_file_name(video_stream))
+    try:
+        with open(path) as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+    return sorted(entries, key=lambda entry: entry['chunk_number'])
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stream', '0007_catdetection_video_stream_alter_catdetection_chunk'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunk',
+            name='encode_speed',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='videostream',
+            name='encoder_profile',
+            field=models.CharField(choices=[('vp8_good', 'Vp8 Good'), ('vp8_realtime', 'Vp8 Realtime'), ('vp9_realtime', 'Vp9 Realtime'), ('mjpeg_copy', 'Mjpeg Copy'), ('h264', 'H264')], default='vp8_good', max_length=32),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stream', '0008_encoder_profiles'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='videostream',
+            name='encoder_profile',
+            field=models.CharField(choices=[('vp8_good', 'Vp8 Good'), ('vp8_realtime', 'Vp8 Realtime'), ('vp9_realtime', 'Vp9 Realtime'), ('mjpeg_copy', 'Mjpeg Copy'), ('h264', 'H264'), ('h264_copy', 'H264 Copy')], default='vp8_good', max_length=32),
+        ),
+    ]
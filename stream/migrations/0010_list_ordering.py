@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:43
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stream', '0009_h264_copy_profile'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='catdetection',
+            options={'ordering': ['-id']},
+        ),
+        migrations.AlterModelOptions(
+            name='chunk',
+            options={'ordering': ['chunk_number']},
+        ),
+        migrations.AlterModelOptions(
+            name='videostream',
+            options={'ordering': ['-id']},
+        ),
+    ]
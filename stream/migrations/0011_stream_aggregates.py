@@ -0,0 +1,72 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:44
+
+import os
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_aggregates(apps, schema_editor):
+    VideoStream = apps.get_model('stream', 'VideoStream')
+    Chunk = apps.get_model('stream', 'Chunk')
+    for chunk in Chunk.objects.all():
+        try:
+            chunk.file_size = os.path.getsize(chunk.video_file.path)
+        except (OSError, ValueError):
+            continue
+        chunk.save(update_fields=['file_size'])
+    for vs in VideoStream.objects.annotate(n_chunks=Count('chunks', distinct=True), n_detections=Count('catdetections_on_vs', distinct=True)):
+        vs.chunk_count = vs.n_chunks
+        vs.detection_count = vs.n_detections
+        vs.total_bytes = sum(Chunk.objects.filter(video_stream=vs).values_list('file_size', flat=True))
+        vs.save(update_fields=['chunk_count', 'detection_count', 'total_bytes'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stream', '0010_list_ordering'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunk',
+            name='duration',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='chunk',
+            name='file_size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='videostream',
+            name='chunk_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='videostream',
+            name='detection_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='videostream',
+            name='duration',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='videostream',
+            name='total_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='videostream',
+            name='started',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.AddConstraint(
+            model_name='chunk',
+            constraint=models.UniqueConstraint(fields=('video_stream', 'chunk_number'), name='unique_chunk_number_per_stream'),
+        ),
+        migrations.RunPython(backfill_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:45
+
+import stream.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stream', '0011_stream_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='catdetection',
+            name='medium_file',
+            field=models.FileField(blank=True, upload_to=stream.models.frame_upload_path),
+        ),
+        migrations.AddField(
+            model_name='catdetection',
+            name='thumbnail_file',
+            field=models.FileField(blank=True, upload_to=stream.models.frame_upload_path),
+        ),
+    ]
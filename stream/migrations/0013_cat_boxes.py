@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:46
+
+import stream.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stream', '0012_cat_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='catdetection',
+            name='box_scale',
+            field=models.FloatField(default=1),
+        ),
+        migrations.AddField(
+            model_name='catdetection',
+            name='boxes',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='catdetection',
+            name='crop_file',
+            field=models.FileField(blank=True, upload_to=stream.models.frame_upload_path),
+        ),
+    ]
@@ -1,6 +1,9 @@
-from django.db import models
+from django.db import models, transaction
 import os
-from django.db.models.signals import pre_delete
+from django.db.models import F, Min, Max
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db.models.signals import pre_delete, post_save, post_delete
 
 from django.dispatch import receiver
 
@@ -8,28 +11,89 @@ import re
 
 # Create your models here.
 class VideoStream(models.Model):
-    started = models.DateTimeField(auto_now=True)
+    started = models.DateTimeField(auto_now_add=True)
     stopped = models.DateTimeField(null=True)
     class SOURCE_CHOICES(models.IntegerChoices):
         SOURCE_ARPI = 0
         SOURCE_PHONE = 1
     source = models.IntegerField(choices=SOURCE_CHOICES)
+    class ENCODER_PROFILE_CHOICES(models.TextChoices):
+        VP8_GOOD = 'vp8_good'
+        VP8_REALTIME = 'vp8_realtime'
+        VP9_REALTIME = 'vp9_realtime'
+        MJPEG_COPY = 'mjpeg_copy'
+        H264 = 'h264'
+        H264_COPY = 'h264_copy'
+    encoder_profile = models.CharField(max_length=32, choices=ENCODER_PROFILE_CHOICES, default=ENCODER_PROFILE_CHOICES.VP8_GOOD)
+
+    # Denormalised aggregates, kept up to date by the Chunk/CatDetection signals below
+    chunk_count = models.IntegerField(default=0)
+    total_bytes = models.BigIntegerField(default=0)
+    detection_count = models.IntegerField(default=0)
+    duration = models.FloatField(default=0)  # seconds
+
+    class Meta:
+        ordering = ['-id']
     
 
 def video_upload_path(instance, filename):
     return f'streams/{instance.video_stream.started.strftime("%Y_%m_%d_%H_%M_%S")}/{filename}'
 
+def chunk_file_name(video_stream, chunk_number, extension='webm'):
+    """Storage name of a chunk file that is written in place instead of uploaded"""
+    return video_upload_path(Chunk(video_stream=video_stream), f'CHUNK_{chunk_number:04d}.{extension}')
+
+def combined_file_name(video_stream, extension='webm'):
+    """Storage name of the stream's combined video, next to its chunks"""
+    return video_upload_path(Chunk(video_stream=video_stream), f'combined.{extension}')
+
 
 class Chunk(models.Model):
     video_stream = models.ForeignKey(VideoStream, on_delete=models.CASCADE, related_name='chunks')
     video_file = models.FileField(upload_to=video_upload_path)
     chunk_number = models.IntegerField()
     created_at = models.DateTimeField(auto_now_add=True)
+    encode_speed = models.FloatField(null=True)  # seconds of video encoded per wall-clock second
+    file_size = models.BigIntegerField(default=0)
+    duration = models.FloatField(null=True)  # seconds
+
+    class Meta:
+        ordering = ['chunk_number']
+        constraints = [
+            models.UniqueConstraint(fields=['video_stream', 'chunk_number'], name='unique_chunk_number_per_stream'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and not self.file_size and self.video_file:
+            try:
+                self.file_size = self.video_file.size
+            except OSError:
+                pass
+        # The stream's counters are updated by post_save, in the same transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
     
     @property
     def meta_fps_dur(self):
         pass
 
+@receiver(post_save, sender=Chunk)
+def count_chunk(sender, instance, created, **kwargs):
+    if created:
+        VideoStream.objects.filter(pk=instance.video_stream_id).update(
+            chunk_count=F('chunk_count') + 1,
+            total_bytes=F('total_bytes') + instance.file_size,
+            duration=F('duration') + (instance.duration or 0),
+        )
+
+@receiver(post_delete, sender=Chunk)
+def uncount_chunk(sender, instance, **kwargs):
+    VideoStream.objects.filter(pk=instance.video_stream_id).update(
+        chunk_count=F('chunk_count') - 1,
+        total_bytes=F('total_bytes') - instance.file_size,
+        duration=F('duration') - (instance.duration or 0),
+    )
+
 @receiver(pre_delete, sender=Chunk)
 def delete_chunk_file(sender, **kwargs):
     if kwargs['instance'].video_file:
@@ -50,5 +114,63 @@ class CatDetection(models.Model):
     chunk = models.ForeignKey(Chunk, on_delete=models.CASCADE, related_name='catdetections_on_chunk', null=True)
     frame_num = models.IntegerField()
     frame_file = models.FileField(upload_to=frame_upload_path)
+    thumbnail_file = models.FileField(upload_to=frame_upload_path, blank=True)
+    medium_file = models.FileField(upload_to=frame_upload_path, blank=True)
+    crop_file = models.FileField(upload_to=frame_upload_path, blank=True)  # around the best box
+    # [[x1, y1, x2, y2, score], ...] in the detector's (lores) pixels, times box_scale gives frame_file pixels
+    boxes = models.JSONField(default=list, blank=True)
+    box_scale = models.FloatField(default=1)
     created_at = models.DateTimeField(auto_now_add=True)
-    
\ No newline at end of file
+
+    class Meta:
+        ordering = ['-id']
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    @property
+    def frame_boxes(self):
+        """boxes scaled to frame_file pixels"""
+        return [[round(c * self.box_scale) for c in box[:4]] + [box[4]] for box in self.boxes]
+
+    @property
+    def best_box(self):
+        """Highest scoring box in frame_file pixels, None without boxes"""
+        boxes = self.frame_boxes
+        return max(boxes, key=lambda box: box[4]) if boxes else None
+
+    def attach_derivatives(self, derivatives):
+        """Store the output of stream.thumbnails.make_derivatives next to the frame"""
+        base = os.path.splitext(os.path.basename(self.frame_file.name))[0]
+        for name, data in derivatives.items():
+            getattr(self, f'{name}_file').save(f'{base}_{name}.jpg', ContentFile(data), save=False)
+        self.save(update_fields=[f'{name}_file' for name in derivatives])
+
+@receiver(post_save, sender=CatDetection)
+def count_cat_detection(sender, instance, created, **kwargs):
+    if created and instance.video_stream_id:
+        VideoStream.objects.filter(pk=instance.video_stream_id).update(detection_count=F('detection_count') + 1)
+
+@receiver(post_delete, sender=CatDetection)
+def uncount_cat_detection(sender, instance, **kwargs):
+    if instance.video_stream_id:
+        VideoStream.objects.filter(pk=instance.video_stream_id).update(detection_count=F('detection_count') - 1)
+    
+
+CAT_ID_RANGE_CACHE_KEY = 'catdetection_id_range'
+
+def cat_detection_id_range():
+    """Cached (min id, max id) of the detections, (None, None) when there are none"""
+    id_range = cache.get(CAT_ID_RANGE_CACHE_KEY)
+    if id_range is None:
+        ids = CatDetection.objects.aggregate(Min('id'), Max('id'))
+        id_range = (ids['id__min'], ids['id__max'])
+        cache.set(CAT_ID_RANGE_CACHE_KEY, id_range, None)
+    return id_range
+
+@receiver(post_save, sender=CatDetection)
+def extend_cat_id_range(sender, instance, created, **kwargs):
+    if created:
+        low, high = cat_detection_id_range()
+        cache.set(CAT_ID_RANGE_CACHE_KEY, (low if low is not None else instance.id, max(high or 0, instance.id)), None)
@@ -0,0 +1,53 @@
+import time
+
+import numpy as np
+
+
+class MotionDetector:
+    """
+    Cheap motion detection on a luma (Y) plane.
+
+    The frame is block-averaged down by `block` in both directions and
+    compared against a running-average background. Motion is reported
+    when more than `area_threshold` of the blocks differ from the
+    background by more than `pixel_threshold` grey levels.
+    """
+
+    def __init__(self, block=8, alpha=0.05, pixel_threshold=20, area_threshold=0.01):
+        self.block = block
+        self.alpha = alpha
+        self.pixel_threshold = pixel_threshold
+        self.area_threshold = area_threshold
+        self.background = None
+        self.motion_ratio = 0.0
+        self.last_motion = None
+        self.frames = 0
+        self.motion_frames = 0
+
+    def downscale(self, luma):
+        b = self.block
+        h, w = luma.shape[0] // b * b, luma.shape[1] // b * b
+        return luma[:h, :w].reshape(h // b, b, w // b, b).mean(axis=(1, 3), dtype=np.float32)
+
+    def update(self, luma):
+        """Feed one Y plane (2D uint8 array), returns True if it shows motion"""
+        small = self.downscale(luma)
+        self.frames += 1
+        if self.background is None:
+            self.background = small
+            return False
+
+        diff = np.abs(small - self.background)
+        self.motion_ratio = np.count_nonzero(diff > self.pixel_threshold) / diff.size
+        # Slowly absorb lighting changes and things that stopped moving into the background
+        self.background += self.alpha * (small - self.background)
+
+        if self.motion_ratio >= self.area_threshold:
+            self.last_motion = time.monotonic()
+            self.motion_frames += 1
+            return True
+        return False
+
+    def moved_within(self, seconds):
+        return self.last_motion is not None and time.monotonic() - self.last_motion <= seconds
+
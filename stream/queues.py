@@ -0,0 +1,30 @@
+import asyncio
+
+
+class DropOldestQueue(asyncio.Queue):
+    """
+    Bounded asyncio queue for stages where only recent items matter.
+
+    put() never blocks: when the queue is full the oldest item is thrown away
+    to make room. With maxsize=1 it coalesces, the reader only ever sees the
+    newest item.
+    """
+
+    def __init__(self, maxsize, name=''):
+        super().__init__(maxsize)
+        self.name = name
+        self.dropped = 0
+        self.high_water = 0
+
+    def put_nowait(self, item):
+        if self.full():
+            self.get_nowait()
+            self.dropped += 1
+        super().put_nowait(item)
+        self.high_water = max(self.high_water, self.qsize())
+
+    async def put(self, item):
+        self.put_nowait(item)
+
+    def stats(self):
+        return {'depth': self.qsize(), 'max': self.maxsize, 'high_water': self.high_water, 'dropped': self.dropped}
@@ -0,0 +1,215 @@
+import glob
+import json
+import os
+import subprocess
+import threading
+import time
+
+from django.conf import settings
+import numpy as np
+import simplejpeg
+from PIL import Image
+
+from stream.ultrasonic import UltrasonicSensor
+
+
+class SyntheticFrameSource:
+    """Replays RGB frames on a thread at a fixed rate, encoded the way the camera's MJPEG encoders would"""
+
+    supports_stream_copy = False
+
+    def __init__(self, fps=30, width=1920, height=1080, lores_size=(960, 540), loop=True, quality=85):
+        self.framerate = fps
+        self.width = width
+        self.height = height
+        self.lores_size = tuple(lores_size)
+        self.loop = loop
+        self.quality = quality
+
+        self.frames = 0
+        self.late_frames = 0  # frames that couldn't be produced in time for the target fps
+        self._latest_lores = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def read_frames(self):
+        """Yield (H, W, 3) uint8 RGB arrays, once through the input"""
+        raise NotImplementedError
+
+    def start(self, fullres_bus, lores_bus, stream_copy=False, on_lores_luma=None, keep_lores=False):
+        if stream_copy:
+            raise ValueError(f"{type(self).__name__} only produces JPEG frames")
+        self._thread = threading.Thread(
+            target=self._run, args=(fullres_bus, lores_bus, on_lores_luma), name='frame-source', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        print(f"{type(self).__name__} stopped after {self.frames} frames, {self.late_frames} late")
+
+    def latest_lores(self):
+        """Lores RGB array of the newest frame, like PicameraSource (where it's YUV)"""
+        if self._latest_lores is None:
+            raise RuntimeError("No frame produced yet")
+        return self._latest_lores
+
+    def lores_to_rgb(self, lores):
+        """A latest_lores() array as float32 RGB in [0, 1]"""
+        return lores.astype(np.float32) * (1 / 255)
+
+    def _run(self, fullres_bus, lores_bus, on_lores_luma):
+        interval = 1 / self.framerate
+        next_frame = time.monotonic()
+        while not self._stop.is_set():
+            produced = False
+            for rgb in self.read_frames():
+                produced = True
+                if self._stop.is_set():
+                    return
+                self._publish(rgb, fullres_bus, lores_bus, on_lores_luma)
+
+                next_frame += interval
+                delay = next_frame - time.monotonic()
+                if delay > 0:
+                    self._stop.wait(delay)
+                else:
+                    self.late_frames += 1
+                    next_frame = time.monotonic()
+            if not produced:
+                print(f"{type(self).__name__} has no frames")
+                return
+            if not self.loop:
+                return
+
+    def _publish(self, rgb, fullres_bus, lores_bus, on_lores_luma):
+        image = Image.fromarray(rgb)
+        if image.size != (self.width, self.height):
+            image = image.resize((self.width, self.height), Image.BILINEAR)
+        lores_image = image.resize(self.lores_size, Image.BILINEAR)
+        fullres = np.asarray(image)
+        lores = np.asarray(lores_image)
+
+        fullres_bus.publish_threadsafe(simplejpeg.encode_jpeg(fullres, quality=self.quality, colorspace='RGB', colorsubsampling='420'))
+        lores_bus.publish_threadsafe(simplejpeg.encode_jpeg(lores, quality=self.quality, colorspace='RGB', colorsubsampling='420'))
+        self._latest_lores = lores
+        self.frames += 1
+        if on_lores_luma is not None:
+            on_lores_luma(np.asarray(lores_image.convert('L')))
+
+
+class JpegDirectorySource(SyntheticFrameSource):
+    """Replays the JPEGs of a directory in name order"""
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.paths = sorted(glob.glob(os.path.join(path, '*.jpg')) + glob.glob(os.path.join(path, '*.jpeg')))
+
+    def read_frames(self):
+        for path in self.paths:
+            with open(path, 'rb') as f:
+                yield simplejpeg.decode_jpeg(f.read(), colorspace='RGB')
+
+
+class VideoFileSource(SyntheticFrameSource):
+    """Replays a video file, decoded by ffmpeg straight to the full-res size"""
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+
+    def read_frames(self):
+        process = subprocess.Popen(
+            [
+                'ffmpeg', '-nostats', '-loglevel', 'error',
+                '-i', self.path,
+                '-vf', f'scale={self.width}:{self.height}',
+                '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-',
+            ],
+            stdout=subprocess.PIPE,
+        )
+        frame_bytes = self.width * self.height * 3
+        try:
+            while True:
+                data = process.stdout.read(frame_bytes)
+                if len(data) < frame_bytes:
+                    break
+                yield np.frombuffer(data, dtype=np.uint8).reshape(self.height, self.width, 3)
+        finally:
+            process.kill()
+            process.wait()
+
+
+class ScriptedDistanceSource:
+    """
+    Plays back a distance trace instead of the ultrasonic sensor.
+
+    The trace is a list of [seconds, cm] pairs (or the path of a JSON file
+    holding one), each distance is delivered that many seconds after start.
+    """
+
+    def __init__(self, trace, loop=True):
+        if isinstance(trace, str):
+            with open(trace) as f:
+                trace = json.load(f)
+        self.trace = sorted((float(t), float(distance)) for t, distance in trace)
+        self.loop = loop
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, loop, callback):
+        self._thread = threading.Thread(target=self._run, args=(loop, callback), name='distance-source', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self, loop, callback):
+        if not self.trace:
+            return
+        # A looping trace restarts one step after its last entry
+        period = self.trace[-1][0] + (self.trace[-1][0] - self.trace[-2][0] if len(self.trace) > 1 else 1.0)
+        started = time.monotonic()
+        while True:
+            for offset, distance in self.trace:
+                if self._stop.wait(max(0.0, started + offset - time.monotonic())):
+                    return
+                loop.call_soon_threadsafe(callback, distance)
+            if not self.loop:
+                return
+            started += period
+
+
+# Frame sources publish full-res and lores JPEGs into two FrameBuses, distance
+# sources call back on the asyncio loop with distances in cm. The synthetic ones
+# let the whole pipeline run without the camera and the sensor.
+FRAME_SOURCES = {
+    'jpeg_dir': JpegDirectorySource,
+    'video': VideoFileSource,
+}
+
+DISTANCE_SOURCES = {
+    'ultrasonic': UltrasonicSensor,
+    'scripted': ScriptedDistanceSource,
+}
+
+
+def get_frame_source():
+    """New frame source as configured in settings.FRAME_SOURCE"""
+    config = dict(settings.FRAME_SOURCE)
+    kind = config.pop('type')
+    if kind == 'picamera':
+        # picamera2 only exists on the Pi, import it only when the camera is used
+        from stream.sources_picamera import PicameraSource
+        return PicameraSource(**config)
+    return FRAME_SOURCES[kind](**config)
+
+
+def get_distance_source():
+    """New distance source as configured in settings.DISTANCE_SOURCE"""
+    config = dict(settings.DISTANCE_SOURCE)
+    return DISTANCE_SOURCES[config.pop('type')](**config)
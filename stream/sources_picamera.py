@@ -0,0 +1,96 @@
+import io
+
+import numpy as np
+from picamera2 import MappedArray, Picamera2
+from picamera2.encoders import H264Encoder, MJPEGEncoder
+from picamera2.outputs import FileOutput, Output
+
+from stream.yuv import yuv420_luma, yuv420_to_rgb
+
+
+class StreamingOutput(io.BufferedIOBase):
+    def __init__(self, bus):
+        self.bus = bus
+
+    def write(self, buf):
+        self.bus.publish_threadsafe(buf)
+
+
+class KeyframeOutput(Output):
+    """Publishes (frame, keyframe) pairs, so the H.264 stream can be cut at keyframes"""
+    def __init__(self, bus):
+        super().__init__()
+        self.bus = bus
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+        self.bus.publish_threadsafe((frame, keyframe))
+
+
+class PicameraSource:
+    """The Pi camera, full-res MJPEG (or H.264) and lores MJPEG from the hardware encoders"""
+
+    supports_stream_copy = True
+
+    def __init__(self, width=1920, height=1080, lores_size=(960, 540), fps=30):
+        self.width = width
+        self.height = height
+        self.lores_size = tuple(lores_size)
+        self.framerate = fps
+        self.picam2 = None
+        self._lores_buffers = None
+        self._latest_lores = None
+
+    def start(self, fullres_bus, lores_bus, stream_copy=False, on_lores_luma=None, keep_lores=False):
+        self.picam2 = Picamera2()
+        config = self.picam2.create_video_configuration(
+            main={"size": (self.width, self.height), "format": "RGB888"},
+            lores={"size": self.lores_size, "format": "YUV420"},
+            controls={"FrameRate": self.framerate}
+        )
+        self.picam2.configure(config)
+        if on_lores_luma is not None or keep_lores:
+            self.picam2.post_callback = lambda request: self._map_lores(request, on_lores_luma, keep_lores)
+
+        if stream_copy:
+            # Hardware H.264 with SPS/PPS repeated on every (1 s apart) keyframe, so any keyframe can start a chunk
+            fullres_encoder = H264Encoder(bitrate=10000000, repeat=True, iperiod=self.framerate)
+            fullres_output = KeyframeOutput(fullres_bus)
+        else:
+            fullres_encoder = MJPEGEncoder()
+            fullres_output = FileOutput(StreamingOutput(fullres_bus))
+
+        self.picam2.start_recording(fullres_encoder, fullres_output)
+        self.picam2.start_encoder(MJPEGEncoder(), FileOutput(StreamingOutput(lores_bus)), name="lores")
+
+    def _map_lores(self, request, on_lores_luma, keep_lores):
+        """post_callback, runs on the camera thread for every frame before it's encoded"""
+        with MappedArray(request, "lores") as m:
+            if on_lores_luma is not None:
+                on_lores_luma(yuv420_luma(m.array, *self.lores_size))
+            if keep_lores:
+                # The buffer goes back to the camera, copy it into whichever of
+                # two preallocated arrays isn't the latest one
+                if self._lores_buffers is None:
+                    self._lores_buffers = [np.empty_like(m.array), np.empty_like(m.array)]
+                buffer = self._lores_buffers[1] if self._latest_lores is self._lores_buffers[0] else self._lores_buffers[0]
+                np.copyto(buffer, m.array)
+                self._latest_lores = buffer
+
+    def stop(self):
+        try:
+            self.picam2.stop_recording()
+            self.picam2.stop_encoder()
+            self.picam2.close()
+        except:
+            pass
+
+    def latest_lores(self):
+        """Copy of the newest raw YUV420 lores array (needs keep_lores), cheap enough for the event loop"""
+        if self._latest_lores is None:
+            raise RuntimeError("No lores frame kept yet")
+        # The camera thread reuses the buffer two frames later
+        return self._latest_lores.copy()
+
+    def lores_to_rgb(self, lores):
+        """A latest_lores() array as float32 RGB, skipping the JPEG round-trip (blocking)"""
+        return yuv420_to_rgb(lores, *self.lores_size)
@@ -0,0 +1,270 @@
+import fcntl
+import json
+import os
+import queue
+import shutil
+import struct
+import threading
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from stream.ffmpeg import ChunkEncoder
+from stream.files import write_file_atomic
+from stream.manifest import append_to_manifest
+from stream.models import Chunk, VideoStream
+
+
+INDEX_RECORD = struct.Struct('<QIB')  # offset, length, keyframe
+
+
+class ChunkSpool:
+    """
+    Append-only on-disk journal of one chunk's raw frames.
+
+    frames.bin holds the frames back to back (a plain MJPEG stream, or the
+    H.264 elementary stream), index.bin a fixed size record per frame and
+    meta.json what's needed to encode and register the chunk later. A frame
+    only counts once its index record is complete, so a crash mid-write
+    costs at most that frame. The owning process holds a lock on the spool
+    until it's removed, which is how recovery tells live spools from orphans.
+
+    A spool being recorded is written by a background thread, write() only
+    queues the frame. With queue_size, frames are dropped (and counted) once
+    that many are waiting, so a stalled disk never blocks the caller.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.chunk_number = self.meta['chunk_number']
+        self.frame_count = os.path.getsize(self._file('index.bin')) // INDEX_RECORD.size
+        self.size = os.path.getsize(self._file('frames.bin'))
+        self.started = time.monotonic()
+        self.max_duration = None
+        self.max_bytes = None
+        self.dropped = 0
+        self.error = None
+        self._frames = None
+        self._writer = None
+        self._lock = None
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    @classmethod
+    def create(cls, video_stream, chunk_number, file_name, profile, framerate, width, height, max_duration=None, max_bytes=None, queue_size=0):
+        name = f'{video_stream.id}-{chunk_number:04d}'
+        path = os.path.join(settings.RECORDING_SPOOL_DIR, name)
+        # Built under a hidden name and renamed into place once it's locked,
+        # so recovery never sees a spool of ours that it could claim
+        tmp_path = os.path.join(settings.RECORDING_SPOOL_DIR, f'.{name}.tmp')
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for part in ('frames.bin', 'index.bin'):
+            open(os.path.join(tmp_path, part), 'wb').close()
+        meta = {
+            'video_stream': video_stream.id,
+            'chunk_number': chunk_number,
+            'file_name': file_name,
+            'profile': profile,
+            'framerate': framerate,
+            'width': width,
+            'height': height,
+        }
+        write_file_atomic(os.path.join(tmp_path, 'meta.json'), json.dumps(meta).encode())
+        lock = open(os.path.join(tmp_path, 'meta.json'))
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        os.rename(tmp_path, path)
+
+        spool = cls(path)
+        spool._lock = lock
+        spool.max_duration = max_duration
+        spool.max_bytes = max_bytes
+        spool._frames = queue.Queue(queue_size)
+        spool._writer = threading.Thread(target=spool._write_frames, name='chunk-spool', daemon=True)
+        spool._writer.start()
+        return spool
+
+    def lock(self, blocking=True):
+        """Claim the spool for this process, False if another process has it"""
+        try:
+            self._lock = open(self._file('meta.json'))
+        except FileNotFoundError:
+            return False  # Removed by its owner meanwhile
+        try:
+            fcntl.flock(self._lock, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            self._lock.close()
+            self._lock = None
+            return False
+        return True
+
+    def unlock(self):
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
+
+    def write(self, frame, keyframe=True):
+        """Queue a frame for the writer thread, False if it had to be dropped"""
+        try:
+            self._frames.put_nowait((frame, keyframe))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.size += len(frame)
+        self.frame_count += 1
+        return True
+
+    def _write_frames(self):
+        offset = 0
+        with open(self._file('frames.bin'), 'ab', buffering=0) as data, open(self._file('index.bin'), 'ab', buffering=0) as index:
+            while True:
+                item = self._frames.get()
+                if item is None:
+                    break
+                if self.error is not None:
+                    continue
+                frame, keyframe = item
+                try:
+                    data.write(frame)
+                    index.write(INDEX_RECORD.pack(offset, len(frame), keyframe))
+                except OSError as e:
+                    # Stop appending, the frames before this one are still intact
+                    print(f"Couldn't spool frame to {self.path}: {e}")
+                    self.error = e
+                    continue
+                offset += len(frame)
+            os.fsync(data.fileno())
+            os.fsync(index.fileno())
+
+    @property
+    def duration(self):
+        return time.monotonic() - self.started
+
+    def should_roll(self):
+        """True once the chunk is long enough, or the spooled frames big enough, to start a new one"""
+        if self.max_duration is not None and self.duration >= self.max_duration:
+            return True
+        return self.max_bytes is not None and self.size >= self.max_bytes
+
+    def seal(self):
+        """No more frames, waits until the queued ones are on disk and the spool can be encoded (blocking)"""
+        if self._writer is not None:
+            self._frames.put(None)
+            self._writer.join()
+            self._writer = None
+
+    def frames(self):
+        """The spooled frames in order, skipping a torn last record"""
+        with open(self._file('index.bin'), 'rb') as index, open(self._file('frames.bin'), 'rb') as data:
+            size = os.fstat(data.fileno()).st_size
+            while True:
+                record = index.read(INDEX_RECORD.size)
+                if len(record) < INDEX_RECORD.size:
+                    return
+                offset, length, keyframe = INDEX_RECORD.unpack(record)
+                if offset + length > size:
+                    return
+                yield os.pread(data.fileno(), length, offset)
+
+    def encode(self):
+        """Encode the spooled frames into the chunk file, returns the closed ChunkEncoder (blocking)"""
+        meta = self.meta
+        encoder = ChunkEncoder(
+            os.path.join(settings.MEDIA_ROOT, meta['file_name']),
+            framerate=meta['framerate'],
+            width=meta['width'],
+            height=meta['height'],
+            profile=meta['profile'],
+            queue_size=settings.PIPELINE_QUEUES['encoder_frames'],
+        )
+        for frame in self.frames():
+            encoder.write(frame)
+        encoder.close()
+        return encoder
+
+    def last_write(self):
+        """When a frame was last spooled"""
+        return datetime.fromtimestamp(os.path.getmtime(self._file('index.bin')), tz=timezone.get_current_timezone())
+
+    def remove(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.unlock()
+
+
+def register_chunk(video_stream, spool, encoder):
+    """Create the Chunk of an encoded spool and add it to the manifest"""
+    chunk = Chunk.objects.create(
+        video_stream=video_stream,
+        chunk_number=spool.chunk_number,
+        video_file=spool.meta['file_name'],
+        encode_speed=encoder.encode_speed,
+        duration=encoder.media_duration,
+    )
+    append_to_manifest(chunk, encoder.media_duration)
+    return chunk
+
+
+def pending_spools():
+    """Every spool on disk, in stream and chunk order"""
+    try:
+        names = os.listdir(settings.RECORDING_SPOOL_DIR)
+    except FileNotFoundError:
+        return []
+    spools = []
+    for name in names:
+        path = os.path.join(settings.RECORDING_SPOOL_DIR, name)
+        try:
+            if name.startswith('.'):
+                # Being created, or a crash left it half-created
+                if time.time() - os.path.getmtime(path) > settings.RECORDING_RECOVERY_GRACE:
+                    shutil.rmtree(path, ignore_errors=True)
+                continue
+            spools.append(ChunkSpool(path))
+        except FileNotFoundError:
+            continue  # Renamed or removed by its owner meanwhile
+    return sorted(spools, key=lambda spool: (spool.meta['video_stream'], spool.chunk_number))
+
+
+def recover_recordings():
+    """
+    Encode and register the chunks a crash left in the spool, and close the
+    streams that never got stopped (blocking). Spools and streams of a
+    recording that is still running, in this or another process, are left alone.
+    """
+    live_streams = set()
+    last_writes = {}
+    for spool in pending_spools():
+        stream_id = spool.meta['video_stream']
+        if not spool.lock(blocking=False):
+            live_streams.add(stream_id)
+            continue
+        vs = VideoStream.objects.filter(id=stream_id).first()
+        try:
+            if vs is not None and spool.frame_count and not Chunk.objects.filter(video_stream=vs, chunk_number=spool.chunk_number).exists():
+                print(f"Recovering chunk {spool.chunk_number} of stream {stream_id} ({spool.frame_count} frames)")
+                register_chunk(vs, spool, spool.encode())
+            last_writes[stream_id] = max(last_writes.get(stream_id, spool.last_write()), spool.last_write())
+            spool.remove()
+        except Exception as e:
+            # Keep the frames, the next start tries again
+            print(f"Couldn't recover {spool.path}: {e}")
+            spool.unlock()
+
+    started_before = timezone.now() - timedelta(seconds=settings.RECORDING_RECOVERY_GRACE)
+    orphans = VideoStream.objects.filter(stopped=None, started__lt=started_before).exclude(id__in=live_streams)
+    for vs in orphans:
+        vs.stopped = last_writes.get(vs.id, vs.started + timedelta(seconds=vs.duration))
+        vs.save(update_fields=['stopped'])
+        print(f"Closed orphaned stream {vs.id}")
+
+
+def start_recovery():
+    """Run recover_recordings in the background"""
+    thread = threading.Thread(target=recover_recordings, name='recording-recovery', daemon=True)
+    thread.start()
+    return thread
@@ -41,6 +41,10 @@ function displayFrame(arrayBuffer) {
   img.onload = () => {
     ctx.drawImage(img, 0, 0, canvas.width, canvas.height);
     URL.revokeObjectURL(url); // Clean up
+    // Ask for the next frame, the server only sends one at a time
+    if (ws && ws.readyState === WebSocket.OPEN) {
+      ws.send(JSON.stringify({ _meta_action: 'ACK' }));
+    }
   };
   img.src = url;
 }
@@ -0,0 +1,36 @@
+// Plays a whole stream by walking its chunk manifest, no combined file needed
+const player = document.querySelector('#stream_player');
+
+let chunks = [];
+let current = -1;
+let stopped = false;
+
+async function loadManifest() {
+  const response = await fetch(player.dataset.manifest);
+  const manifest = await response.json();
+  chunks = manifest.chunks;
+  stopped = manifest.stopped;
+}
+
+function playChunk(i) {
+  current = i;
+  player.src = chunks[i].url;
+  player.play();
+}
+
+player.addEventListener('ended', async () => {
+  // A running stream may have saved new chunks since the page loaded
+  if (current + 1 >= chunks.length && !stopped) {
+    await loadManifest();
+  }
+  if (current + 1 < chunks.length) {
+    playChunk(current + 1);
+  }
+});
+
+loadManifest().then(() => {
+  if (chunks.length > 0) {
+    current = 0;
+    player.src = chunks[0].url;
+  }
+});
@@ -1,3 +1,325 @@
-from django.test import TestCase
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from stream.framebus import FrameBus
+from stream.models import CatDetection, Chunk, VideoStream, chunk_file_name
+from stream.queues import DropOldestQueue
+from stream.spool import INDEX_RECORD, ChunkSpool, pending_spools, recover_recordings
+from stream.ultrasonic import EchoTimer
+
+
+class FakeEncoder:
+    """Stands in for ChunkEncoder, collects the frames instead of running ffmpeg"""
+    instances = []
+
+    def __init__(self, output_path, framerate=30, **kwargs):
+        self.output_path = output_path
+        self.framerate = framerate
+        self.frames = []
+        self.encode_speed = 1.0
+        FakeEncoder.instances.append(self)
+
+    def write(self, frame):
+        self.frames.append(frame)
+
+    @property
+    def media_duration(self):
+        return len(self.frames) / self.framerate
+
+    def close(self):
+        os.makedirs(os.path.dirname(self.output_path), exist_ok=True)
+        with open(self.output_path, 'wb') as f:
+            f.write(b''.join(self.frames))
+
+
+class SpoolRecoveryTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.spool_dir = os.path.join(self.root, 'spool')
+        os.makedirs(self.spool_dir)
+        self.settings_override = override_settings(MEDIA_ROOT=self.root, RECORDING_SPOOL_DIR=self.spool_dir, RECORDING_RECOVERY_GRACE=60)
+        self.settings_override.enable()
+        self.encoder_patch = mock.patch('stream.spool.ChunkEncoder', FakeEncoder)
+        self.encoder_patch.start()
+        FakeEncoder.instances = []
+
+    def tearDown(self):
+        self.encoder_patch.stop()
+        self.settings_override.disable()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def make_stream(self, age=3600):
+        vs = VideoStream.objects.create(source=0, encoder_profile='vp8_realtime')
+        VideoStream.objects.filter(id=vs.id).update(started=timezone.now() - timedelta(seconds=age))
+        vs.refresh_from_db()
+        return vs
+
+    def make_spool(self, vs, chunk_number, frames):
+        spool = ChunkSpool.create(vs, chunk_number, chunk_file_name(vs, chunk_number), 'vp8_realtime', framerate=10, width=16, height=16)
+        for frame in frames:
+            spool.write(frame)
+        spool.seal()
+        return spool
+
+    def test_recovers_orphaned_spool_without_torn_record(self):
+        vs = self.make_stream()
+        frames = [bytes([n]) * 100 for n in range(3)]
+        spool = self.make_spool(vs, 0, frames)
+        # A crash in the middle of the next frame: part of its data and of its index record
+        with open(os.path.join(spool.path, 'frames.bin'), 'ab') as f:
+            f.write(b'\xff' * 40)
+        with open(os.path.join(spool.path, 'index.bin'), 'ab') as f:
+            f.write(INDEX_RECORD.pack(300, 100, 1)[:5])
+        spool.unlock()  # The recording process is gone
+
+        recover_recordings()
+
+        self.assertEqual(FakeEncoder.instances[0].frames, frames)
+        chunk = Chunk.objects.get(video_stream=vs)
+        self.assertEqual(chunk.chunk_number, 0)
+        self.assertAlmostEqual(chunk.duration, 0.3)
+        self.assertFalse(os.path.exists(spool.path))
+        vs.refresh_from_db()
+        self.assertIsNotNone(vs.stopped)
+
+    def test_leaves_live_spool_and_stream_alone(self):
+        vs = self.make_stream()
+        spool = self.make_spool(vs, 0, [b'frame'])  # Still locked, as by a running recording
+
+        recover_recordings()
+
+        self.assertEqual(FakeEncoder.instances, [])
+        self.assertFalse(Chunk.objects.exists())
+        self.assertTrue(os.path.exists(spool.path))
+        vs.refresh_from_db()
+        self.assertIsNone(vs.stopped)
+        spool.remove()
+
+    def test_half_created_spools_are_only_removed_after_the_grace_period(self):
+        fresh = os.path.join(self.spool_dir, '.1-0000.tmp')
+        stale = os.path.join(self.spool_dir, '.2-0000.tmp')
+        os.makedirs(fresh)
+        os.makedirs(stale)
+        old = time.time() - 3600
+        os.utime(stale, (old, old))
+
+        self.assertEqual(pending_spools(), [])
+        self.assertTrue(os.path.exists(fresh))
+        self.assertFalse(os.path.exists(stale))
+
+
+class MediaRangeTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.root, MEDIA_SENDFILE=None)
+        self.settings_override.enable()
+        with open(os.path.join(self.root, 'chunk.webm'), 'wb') as f:
+            f.write(bytes(range(10)))
+        self.client.force_login(User.objects.create_user('viewer'))
+        self.url = reverse('media', args=['chunk.webm'])
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def get(self, range_header):
+        response = self.client.get(self.url, HTTP_RANGE=range_header)
+        return response, b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_single_range(self):
+        response, body = self.get('bytes=2-4')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, bytes([2, 3, 4]))
+        self.assertEqual(response['Content-Range'], 'bytes 2-4/10')
+
+    def test_unsupported_ranges_are_ignored(self):
+        for header in ('bytes=0-1,5-6', 'bytes=5-3', 'items=0-1'):
+            response, body = self.get(header)
+            self.assertEqual(response.status_code, 200, header)
+            self.assertEqual(body, bytes(range(10)))
+
+    def test_unsatisfiable_range(self):
+        for header in ('bytes=10-', 'bytes=-0'):
+            response, body = self.get(header)
+            self.assertEqual(response.status_code, 416, header)
+            self.assertEqual(response['Content-Range'], 'bytes */10')
+
+
+class EchoTimerTests(TestCase):
+    MS = 1_000_000  # ns
+
+    def feed(self, timer, edges):
+        for level, tick in edges:
+            timer.edge(level, tick)
+
+    def test_times_pulse_from_edge_timestamps(self):
+        timer = EchoTimer()
+        timer.arm(1000 * self.MS)
+        # A near echo, 1.5 ms long, whatever the callbacks' own timing
+        self.feed(timer, [(1, 1001 * self.MS), (0, 1002.5 * self.MS)])
+        self.assertTrue(timer.done.is_set())
+        self.assertAlmostEqual(timer.pulse, 0.0015)
+
+    def test_ignores_edges_of_an_earlier_ping(self):
+        timer = EchoTimer()
+        timer.arm(1000 * self.MS)
+        self.feed(timer, [(1, 990 * self.MS), (0, 999 * self.MS), (0, 1000.5 * self.MS)])
+        self.assertFalse(timer.done.is_set())
+        self.feed(timer, [(1, 1001 * self.MS), (2, 1002 * self.MS), (0, 1003 * self.MS), (1, 1004 * self.MS), (0, 1010 * self.MS)])
+        self.assertAlmostEqual(timer.pulse, 0.002)
+
+    def test_rearming_forgets_an_unfinished_echo(self):
+        timer = EchoTimer()
+        timer.arm(1000 * self.MS)
+        self.feed(timer, [(1, 1001 * self.MS)])
+        timer.arm(1100 * self.MS)
+        self.feed(timer, [(0, 1101 * self.MS)])
+        self.assertFalse(timer.done.is_set())
+        self.assertIsNone(timer.pulse)
+
+
+class RandomCatTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_user('viewer'))
+        self.vs = VideoStream.objects.create(source=0)
+
+    def make_cats(self, n):
+        return [CatDetection.objects.create(video_stream=self.vs, frame_num=i, frame_file=f'cats/{i}.jpg') for i in range(n)]
+
+    def random_cat(self, pick):
+        # randint decides where the lookup starts
+        with mock.patch('stream.views.random.randint', return_value=pick):
+            return self.client.get('/randomcat/')
+
+    def test_no_cats(self):
+        self.assertEqual(self.client.get('/randomcat/').status_code, 404)
+
+    def test_deleted_id_gives_the_next_existing_one(self):
+        cats = self.make_cats(3)
+        deleted = cats[1].id
+        cats[1].delete()
+        response = self.random_cat(deleted)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cd'].id, cats[2].id)
+
+    def test_deleted_highest_id_wraps_to_the_first(self):
+        cats = self.make_cats(3)
+        highest = cats[2].id
+        cats[2].delete()  # The cached id range still reaches it
+        response = self.random_cat(highest)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cd'].id, cats[0].id)
+
+    def test_all_deleted(self):
+        for cd in self.make_cats(2):
+            cd.delete()
+        self.assertEqual(self.client.get('/randomcat/').status_code, 404)
+
+
+@override_settings(DASH_PAGE_SIZE=3)
+class DashboardPagingTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('viewer'))
+
+    def make_streams(self, n):
+        return [VideoStream.objects.create(source=0) for _ in range(n)]
+
+    def page(self, query=''):
+        response = self.client.get(reverse('dash_streams') + query)
+        return [vs.id for vs in response.context['streamek']], response.context['next_before']
+
+    def test_exactly_one_page(self):
+        streams = self.make_streams(3)
+        self.assertEqual(self.page(), ([vs.id for vs in reversed(streams)], None))
+
+    def test_next_page_follows_the_cursor(self):
+        streams = self.make_streams(5)
+        ids, next_before = self.page()
+        self.assertEqual(ids, [streams[4].id, streams[3].id, streams[2].id])
+        self.assertEqual(next_before, streams[2].id)
+        self.assertEqual(self.page(f'?before={next_before}'), ([streams[1].id, streams[0].id], None))
+
+    def test_non_numeric_cursor_gives_the_first_page(self):
+        streams = self.make_streams(4)
+        ids, next_before = self.page('?before=abc')
+        self.assertEqual(ids[0], streams[3].id)
+        self.assertEqual(next_before, streams[1].id)
+
+    def test_stream_list_query_count_does_not_grow_with_streams(self):
+        self.make_streams(1)
+        with CaptureQueriesContext(connection) as one_stream:
+            self.page()
+        self.make_streams(2)
+        with self.assertNumQueries(len(one_stream)):
+            self.page()
+
+
+class FrameBusTests(SimpleTestCase):
+    async def test_reader_gets_frames_in_order(self):
+        bus = FrameBus(asyncio.get_running_loop(), size=4)
+        cursor = bus.subscribe('reader')
+        for n in range(3):
+            bus.publish(n)
+        self.assertEqual([await cursor.next() for _ in range(3)], [0, 1, 2])
+        self.assertEqual(cursor.lag, 0)
+
+    async def test_reader_a_full_ring_behind_skips_to_the_oldest_kept_frame(self):
+        bus = FrameBus(asyncio.get_running_loop(), size=4)
+        cursor = bus.subscribe('recorder')
+        for n in range(10):
+            bus.publish(n)
+        self.assertEqual([await cursor.next() for _ in range(4)], [6, 7, 8, 9])
+        self.assertEqual(cursor.dropped, 6)
+        self.assertEqual(bus.stats(), {'recorder': {'lag': 0, 'dropped': 6}})
+
+    async def test_close_drains_then_ends(self):
+        bus = FrameBus(asyncio.get_running_loop(), size=4)
+        cursor = bus.subscribe('reader')
+        waiting = asyncio.ensure_future(cursor.next())
+        await asyncio.sleep(0)
+        bus.publish('a')
+        self.assertEqual(await waiting, 'a')
+        bus.publish('b')
+        bus.close()
+        bus.publish('c')  # Ignored once closed
+        self.assertEqual(await cursor.next(), 'b')
+        self.assertIsNone(await cursor.next())
+
+
+class DropOldestQueueTests(SimpleTestCase):
+    async def test_full_queue_drops_the_oldest(self):
+        queue = DropOldestQueue(2)
+        for n in range(4):
+            await queue.put(n)
+        self.assertEqual([queue.get_nowait(), queue.get_nowait()], [2, 3])
+        self.assertEqual(queue.stats(), {'depth': 0, 'max': 2, 'high_water': 2, 'dropped': 2})
+
+    async def test_sentinel_put_last_survives_a_full_queue(self):
+        # STOP relies on this for the detection queue, nothing is put after its None
+        queue = DropOldestQueue(2)
+        await queue.put('a')
+        await queue.put('b')
+        await queue.put(None)
+        self.assertEqual(await queue.get(), 'b')
+        self.assertIsNone(await queue.get())
+
+    async def test_size_one_coalesces(self):
+        queue = DropOldestQueue(1)
+        for n in range(3):
+            queue.put_nowait(n)
+        self.assertEqual(await queue.get(), 2)
+        self.assertTrue(queue.empty())
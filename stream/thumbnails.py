@@ -0,0 +1,54 @@
+import numpy as np
+import simplejpeg
+from PIL import Image
+
+
+# Longest side of each derivative, in pixels
+DERIVATIVE_SIZES = {
+    'thumbnail': 320,
+    'medium': 960,
+}
+CROP_SIZE = 480
+CROP_PADDING = 0.1  # of the box size, on every side
+
+
+def scaled_jpeg(frame, size, quality=80):
+    """Re-encode a JPEG so its longest side is size pixels"""
+    header_height, header_width = simplejpeg.decode_jpeg_header(frame)[:2]
+    scale = size / max(header_width, header_height)
+    width, height = max(1, round(header_width * scale)), max(1, round(header_height * scale))
+
+    # libjpeg scales in the DCT domain while decoding, so a 1080p frame is never fully decoded for a thumbnail
+    pixels = simplejpeg.decode_jpeg(frame, colorspace='RGB', fastdct=True, fastupsample=True, min_width=width, min_height=height)
+    if pixels.shape[1] != width or pixels.shape[0] != height:
+        pixels = np.asarray(Image.fromarray(pixels).resize((width, height), Image.BILINEAR))
+    return simplejpeg.encode_jpeg(pixels, quality=quality, colorspace='RGB', colorsubsampling='420')
+
+
+def cropped_jpeg(frame, box, size=CROP_SIZE, quality=85):
+    """Padded region [x1, y1, x2, y2] of a JPEG frame, shrunk so its longest side is at most size"""
+    pixels = simplejpeg.decode_jpeg(frame, colorspace='RGB', fastdct=True, fastupsample=True)
+    frame_height, frame_width = pixels.shape[:2]
+
+    x1, y1, x2, y2 = box[:4]
+    pad_x, pad_y = (x2 - x1) * CROP_PADDING, (y2 - y1) * CROP_PADDING
+    x1, y1 = max(0, int(x1 - pad_x)), max(0, int(y1 - pad_y))
+    x2, y2 = min(frame_width, int(x2 + pad_x) + 1), min(frame_height, int(y2 + pad_y) + 1)
+
+    image = Image.fromarray(pixels[y1:y2, x1:x2])
+    image.thumbnail((size, size), Image.BILINEAR)
+    return simplejpeg.encode_jpeg(np.ascontiguousarray(np.asarray(image)), quality=quality, colorspace='RGB', colorsubsampling='420')
+
+
+def frame_size(frame):
+    """(width, height) of a JPEG without decoding it"""
+    height, width = simplejpeg.decode_jpeg_header(frame)[:2]
+    return width, height
+
+
+def make_derivatives(frame, crop_box=None):
+    """All derivative JPEGs of a frame, keyed like DERIVATIVE_SIZES, plus 'crop' when a box is given"""
+    derivatives = {name: scaled_jpeg(frame, size) for name, size in DERIVATIVE_SIZES.items()}
+    if crop_box is not None:
+        derivatives['crop'] = cropped_jpeg(frame, crop_box)
+    return derivatives
@@ -0,0 +1,133 @@
+import statistics
+import threading
+import time
+
+
+def filter_outliers(samples, max_deviation=10):
+    """Drop samples that differ too much from the median"""
+    median = statistics.median(samples)
+    filtered = [x for x in samples if abs(x - median) <= max_deviation]
+    return filtered if filtered else samples
+
+
+class EchoTimer:
+    """
+    Turns the echo pin's edges into the length of the echo pulse.
+
+    Works on the level and kernel timestamp (ns) lgpio reports with each
+    edge, so it doesn't matter how late the callback itself runs. Edges
+    stamped before the ping was sent belong to an earlier echo and are ignored.
+    """
+
+    def __init__(self):
+        self._sent = None
+        self._rise = None
+        self.pulse = None  # seconds
+        self.done = threading.Event()
+
+    def arm(self, sent_ns):
+        """A new ping goes out at sent_ns (CLOCK_MONOTONIC, like the kernel's edge timestamps)"""
+        self._sent = sent_ns
+        self._rise = None
+        self.pulse = None
+        self.done.clear()
+
+    def edge(self, level, tick):
+        if self._sent is None or self.done.is_set() or tick < self._sent:
+            return
+        if level == 1:
+            self._rise = tick
+        elif level == 0 and self._rise is not None:
+            self.pulse = (tick - self._rise) / 1e9
+            self.done.set()
+        # level 2 is lgpio's watchdog timeout, not an edge
+
+
+class UltrasonicSensor:
+    """
+    HC-SR04 driver running on its own thread.
+
+    The echo pulse is timed from the timestamps of lgpio edge alerts instead
+    of polling the pin or reading the clock in a callback, and every ping
+    gives up after `timeout` seconds, so a missed echo only costs one
+    sample. Samples are averaged over `window` seconds and the averages are
+    handed to `callback` on the asyncio loop.
+    """
+
+    SPEED_OF_SOUND = 34300  # cm/s
+
+    def __init__(self, trigger=23, echo=24, chip=0, interval=0.1, timeout=0.05, window=1.0, max_distance=800, max_deviation=10):
+        self.trigger = trigger
+        self.echo = echo
+        self.chip = chip
+        self.interval = interval
+        self.timeout = timeout
+        self.window = window
+        self.max_distance = max_distance
+        self.max_deviation = max_deviation
+
+        self.pings = 0
+        self.timeouts = 0
+        self.timer = EchoTimer()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, loop, callback):
+        """Start pinging, callback(distance_cm) is called on loop for every window average"""
+        import lgpio
+        self.lgpio = lgpio
+        self.handle = lgpio.gpiochip_open(self.chip)
+        lgpio.gpio_claim_output(self.handle, self.trigger, 0)
+        lgpio.gpio_claim_alert(self.handle, self.echo, lgpio.BOTH_EDGES)
+        self._alerts = lgpio.callback(self.handle, self.echo, lgpio.BOTH_EDGES, self._edge)
+
+        self._thread = threading.Thread(target=self._run, args=(loop, callback), name='ultrasonic', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the ping thread and release the pins (blocking)"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._alerts.cancel()
+        self.lgpio.gpio_free(self.handle, self.echo)
+        self.lgpio.gpio_free(self.handle, self.trigger)
+        self.lgpio.gpiochip_close(self.handle)
+        print(f"Ultrasonic sensor stopped, {self.timeouts}/{self.pings} pings timed out")
+
+    def _edge(self, chip, gpio, level, tick):
+        """lgpio callback thread"""
+        self.timer.edge(level, tick)
+
+    def ping(self):
+        """One measurement in cm, None if the echo didn't come back in time"""
+        self.timer.arm(time.monotonic_ns())
+        self.lgpio.gpio_write(self.handle, self.trigger, 1)
+        time.sleep(0.00001)
+        self.lgpio.gpio_write(self.handle, self.trigger, 0)
+
+        self.pings += 1
+        if not self.timer.done.wait(self.timeout):
+            self.timeouts += 1
+            return None
+        return round(self.timer.pulse * self.SPEED_OF_SOUND / 2, 1)
+
+    def _run(self, loop, callback):
+        # Let the sensor settle
+        if self._stop.wait(2):
+            return
+
+        samples = []
+        window_start = time.monotonic()
+        while not self._stop.wait(self.interval):
+            distance = self.ping()
+            if distance is not None and distance < self.max_distance:
+                samples.append(distance)
+
+            if time.monotonic() - window_start >= self.window:
+                if samples:
+                    filtered = filter_outliers(samples, self.max_deviation)
+                    average = round(sum(filtered) / len(filtered), 1)
+                    loop.call_soon_threadsafe(callback, average)
+                samples = []
+                window_start = time.monotonic()
@@ -15,6 +15,7 @@ dash_urlpatterns = [
     path('catdetections/<int:id>/', views.dash_cat_detection, name='dash_cat_detection'),
     path('streams/', views.dash_streams, name='dash_streams'),
     path('streams/<int:id>/', views.dash_stream, name='dash_stream'),
+    path('streams/<int:id>/manifest.json', views.dash_stream_manifest, name='dash_stream_manifest'),
     path('streams/<int:sid>/chunks/<int:cid>/', views.dash_stream_chunk, name='dash_stream_chunk'),
 ]
 
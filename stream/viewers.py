@@ -0,0 +1,175 @@
+import asyncio
+import collections
+import time
+
+from django.conf import settings
+
+from stream.thumbnails import scaled_jpeg
+
+
+_hub = None
+
+
+class ViewerHub:
+    """
+    Newest lores frame plus its re-encodings for the lower quality tiers,
+    shared by every viewer. There is no queue: a viewer that isn't ready
+    when a frame is published simply gets a newer one later.
+    """
+
+    def __init__(self, tiers):
+        self.tiers = tiers
+        self.seq = 0
+        self.frame = None
+        self.published_at = None
+        self.variants = {}
+        self.viewers = []
+        self._new_frame = asyncio.Event()
+
+    def publish(self, frame):
+        self.seq += 1
+        self.frame = frame
+        self.published_at = time.monotonic()
+        self.variants = {}
+        # Everyone waiting gets woken, later waiters wait for the next frame
+        new_frame, self._new_frame = self._new_frame, asyncio.Event()
+        new_frame.set()
+
+    async def wait_newer(self, seq):
+        """Wait until a frame newer than seq is published, returns the newest seq"""
+        while self.seq <= seq:
+            await self._new_frame.wait()
+        return self.seq
+
+    async def variant(self, tier):
+        """The current frame as tier wants it, re-encoded at most once per frame and tier"""
+        size, quality = self.tiers[tier]['size'], self.tiers[tier]['quality']
+        if size is None:
+            return self.frame
+        if tier not in self.variants:
+            self.variants[tier] = asyncio.ensure_future(asyncio.to_thread(scaled_jpeg, self.frame, size, quality))
+        # Shielded, one viewer leaving mustn't cancel the encode the others wait for
+        return await asyncio.shield(self.variants[tier])
+
+    def stats(self):
+        return {'frames': self.seq, 'viewers': [viewer.stats() for viewer in self.viewers]}
+
+
+class Viewer:
+    """
+    One websocket client. It always gets the newest frame once it's ready for
+    one, so a slow client only ever costs itself frames.
+
+    Clients that answer every frame with an ACK get one frame in flight at a
+    time and their latency is measured up to the ACK. A client that doesn't
+    acknowledge its first frame is treated as never doing so, and only its
+    send calls are timed. The latency moves the viewer between the quality
+    tiers (frame rate cap, size and JPEG quality).
+    """
+
+    def __init__(self, hub, send, slow=0.25, fast=0.08, hold=2.0, ack_timeout=2.0):
+        self.hub = hub
+        self.send = send
+        self.slow = slow
+        self.fast = fast
+        self.hold = hold  # seconds to stay in a tier before changing again
+        self.ack_timeout = ack_timeout
+
+        self.tier = 0
+        self.latency = None  # moving average, seconds
+        self.delays = collections.deque(maxlen=300)  # publish to delivery, seconds
+        self.sent = 0
+        self.skipped = 0
+        self.acks = None  # unknown until the first frame is acknowledged or times out
+        self._changed_at = time.monotonic()
+        self._acked = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        self.hub.viewers.append(self)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self in self.hub.viewers:
+            self.hub.viewers.remove(self)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def ack(self):
+        self.acks = True
+        self._acked.set()
+
+    async def _run(self):
+        seen = self.hub.seq
+        last_sent = 0
+        while True:
+            await self.hub.wait_newer(seen)
+            # Frame rate cap of the current tier, whatever arrives meanwhile replaces the frame
+            delay = last_sent + 1 / self.hub.tiers[self.tier]['fps'] - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            seq, published_at = self.hub.seq, self.hub.published_at
+            self.skipped += seq - seen - 1
+            seen = seq
+            try:
+                data = await self.hub.variant(self.tier)
+            except Exception as e:
+                print(f"Couldn't prepare frame for viewer: {e}")
+                continue
+
+            last_sent = time.monotonic()
+            self._acked.clear()
+            try:
+                await self.send(data)
+            except Exception:
+                return  # Client disconnected
+            if self.acks is not False:
+                try:
+                    await asyncio.wait_for(self._acked.wait(), self.ack_timeout)
+                except asyncio.TimeoutError:
+                    if self.acks is None:
+                        self.acks = False  # An older client that never acknowledges
+            done = time.monotonic()
+            self.sent += 1
+            self.delays.append(done - published_at)
+            self._adapt(done - last_sent)
+
+    def _adapt(self, latency):
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        if time.monotonic() - self._changed_at < self.hold:
+            return
+        if self.latency > self.slow and self.tier < len(self.hub.tiers) - 1:
+            self.tier += 1
+            self._changed_at = time.monotonic()
+        elif self.latency < self.fast and self.tier > 0:
+            self.tier -= 1
+            self._changed_at = time.monotonic()
+
+    def stats(self):
+        return {
+            'tier': self.tier,
+            'latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None,
+            'sent': self.sent,
+            'skipped': self.skipped,
+            'acks': self.acks,
+        }
+
+
+def get_viewer_hub():
+    """Return the process-wide viewer hub"""
+    global _hub
+    if _hub is None:
+        _hub = ViewerHub(settings.VIEWER_TIERS)
+    return _hub
+
+
+def new_viewer(send):
+    """A started viewer of the process-wide hub, configured from settings"""
+    viewer = Viewer(get_viewer_hub(), send, **settings.VIEWER_ADAPTATION)
+    viewer.start()
+    return viewer
@@ -1,10 +1,18 @@
-from django.shortcuts import render
+from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
-from stream.models import CatDetection, VideoStream, Chunk
+from stream.models import CatDetection, VideoStream, Chunk, cat_detection_id_range
 from django.views.decorators.http import require_http_methods
-from django.http import FileResponse
+from django.http import FileResponse, JsonResponse, HttpResponse, HttpResponseNotModified, Http404
+from django.core.files.storage import default_storage
+from django.conf import settings
+from django.utils._os import safe_join
+from django.core.exceptions import SuspiciousFileOperation
+from django.utils.http import http_date, parse_http_date_safe
+from stream.manifest import read_manifest
+import mimetypes
 import os
 import random
+import re
 
 
 def index(request):
@@ -18,11 +26,22 @@ def stream(request):
 def dash(request):
     return render(request, "dash/index.html", {})
 
+def keyset_page(queryset, request):
+    """Newest-first page of queryset below the ?before=<id> cursor, plus the cursor of the next page"""
+    before = request.GET.get('before')
+    if before and before.isdigit():
+        queryset = queryset.filter(id__lt=int(before))
+    items = list(queryset.order_by('-id')[:settings.DASH_PAGE_SIZE + 1])
+    next_before = None
+    if len(items) > settings.DASH_PAGE_SIZE:
+        items = items[:settings.DASH_PAGE_SIZE]
+        next_before = items[-1].id
+    return items, next_before
+
 @login_required
 def dash_cat_detections(request):
-    cds = [ x for x in CatDetection.objects.all() ]
-    cds.reverse()
-    return render(request, "dash/catdetections.html", {'kepek': cds})
+    cds, next_before = keyset_page(CatDetection.objects.all(), request)
+    return render(request, "dash/catdetections.html", {'kepek': cds, 'next_before': next_before})
 
 @login_required
 def dash_cat_detection(request, id):
@@ -31,17 +50,24 @@ def dash_cat_detection(request, id):
 
 @login_required
 def dash_streams(request):
-    streams = [ {'stream': x, 'chunks': Chunk.objects.filter(video_stream=x).all()} for x in VideoStream.objects.all() ]
-    streams.reverse()
-    return render(request, "dash/streams.html", {'streamek': streams})
+    streams, next_before = keyset_page(VideoStream.objects.all(), request)
+    return render(request, "dash/streams.html", {'streamek': streams, 'next_before': next_before})
 
 @login_required
 def dash_stream(request, id):
     stream = VideoStream.objects.get(id=id)
     chunks = Chunk.objects.filter(video_stream=stream).all()
-    print(stream)
     return render(request, "dash/stream.html", {'stream': stream, 'chunks': chunks})
 
+@login_required
+def dash_stream_manifest(request, id):
+    stream = VideoStream.objects.get(id=id)
+    chunks = [
+        {'chunk_number': e['chunk_number'], 'url': default_storage.url(e['file']), 'duration': e['duration']}
+        for e in read_manifest(stream)
+    ]
+    return JsonResponse({'id': stream.id, 'stopped': stream.stopped is not None, 'chunks': chunks})
+
 @login_required
 def dash_stream_chunk(request, sid, cid):
     stream = VideoStream.objects.get(id=sid)
@@ -56,6 +82,122 @@ def phone_stream(request):
 
 @login_required
 def randomcat(request):
-    ri = random.randint(0, CatDetection.objects.all().__len__() - 1)
-    cd = CatDetection.objects.get(id=ri)
-    return render(request, "dash/catdetection.html", {'cd': cd})
\ No newline at end of file
+    low, high = cat_detection_id_range()
+    if low is None:
+        raise Http404("No cats yet")
+    # Ids can have gaps, take the first existing one from a random point (a primary key lookup)
+    ri = random.randint(low, high)
+    cd = CatDetection.objects.filter(id__gte=ri).order_by('id').first() or CatDetection.objects.order_by('id').first()
+    if cd is None:
+        raise Http404("No cats yet")
+    if 'thumbnail' in request.GET:
+        return redirect(cd.thumbnail_file.url if cd.thumbnail_file else cd.frame_file.url)
+    return render(request, "dash/catdetection.html", {'cd': cd})
+
+
+class RangeFile:
+    """File-like view of length bytes starting at offset, for FileResponse"""
+    def __init__(self, f, offset, length):
+        self.f = f
+        self.f.seek(offset)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """
+    (start, end) of a single 'bytes=' range, inclusive. None when the header
+    isn't one well-formed range (multiple ranges included), which means it's
+    ignored and the whole file is sent. Raises RangeNotSatisfiable when it
+    is, but lies outside the file.
+    """
+    m = re.fullmatch(r'bytes=(\d*)-(\d*)', header.strip())
+    if not m or (not m.group(1) and not m.group(2)):
+        return None
+    if m.group(1):
+        start = int(m.group(1))
+        end = int(m.group(2)) if m.group(2) else size - 1
+        if m.group(2) and end < start:
+            return None  # Invalid, not unsatisfiable
+    else:
+        # Suffix range, the last N bytes
+        if int(m.group(2)) == 0:
+            raise RangeNotSatisfiable
+        start = max(size - int(m.group(2)), 0)
+        end = size - 1
+    if start >= size:
+        raise RangeNotSatisfiable
+    return start, min(end, size - 1)
+
+
+@login_required
+@require_http_methods(["GET", "HEAD"])
+def serve_media(request, path):
+    """Media files (chunks, cat frames) with Range, ETag and Last-Modified support"""
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+    last_modified = http_date(stat.st_mtime)
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+
+    if_none_match = request.headers.get('If-None-Match')
+    if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    if (if_none_match and etag in if_none_match) or (not if_none_match and if_modified_since and int(stat.st_mtime) <= if_modified_since):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        response['Last-Modified'] = last_modified
+        return response
+
+    # Let the front-end server send the file, it handles ranges itself
+    if settings.MEDIA_SENDFILE == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.MEDIA_SENDFILE_PREFIX + path
+    elif settings.MEDIA_SENDFILE == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = full_path
+    else:
+        byte_range = None
+        range_header = request.headers.get('Range')
+        if_range = request.headers.get('If-Range')
+        if range_header and (not if_range or if_range in (etag, last_modified)):
+            try:
+                byte_range = parse_range(range_header, stat.st_size)
+            except RangeNotSatisfiable:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{stat.st_size}'
+                return response
+
+        if byte_range is None:
+            # Whole file, FileResponse can hand it to the server's sendfile
+            response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+        else:
+            start, end = byte_range
+            response = FileResponse(RangeFile(open(full_path, 'rb'), start, end - start + 1), content_type=content_type, status=206)
+            response['Content-Length'] = str(end - start + 1)
+            response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    return response
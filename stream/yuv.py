@@ -0,0 +1,38 @@
+import numpy as np
+
+
+def yuv420_planes(array, width, height):
+    """Y, U and V planes of a picamera2 YUV420 buffer (height * 3 / 2 rows of `stride` bytes)"""
+    stride = array.shape[1]
+    flat = array.reshape(-1)
+    y_size = stride * height
+    uv_size = (stride // 2) * (height // 2)
+    y = flat[:y_size].reshape(height, stride)[:, :width]
+    u = flat[y_size:y_size + uv_size].reshape(height // 2, stride // 2)[:, :width // 2]
+    v = flat[y_size + uv_size:y_size + 2 * uv_size].reshape(height // 2, stride // 2)[:, :width // 2]
+    return y, u, v
+
+
+def yuv420_luma(array, width, height):
+    """Y plane of a picamera2 YUV420 buffer, no copy"""
+    return array[:height, :width]
+
+
+def yuv420_to_rgb(array, width, height):
+    """
+    Convert a YUV420 buffer to a float32 RGB (height, width, 3) array in [0, 1].
+
+    Uses limited range BT.709, which is what picamera2 picks for HD video
+    configurations.
+    """
+    y, u, v = yuv420_planes(array, width, height)
+    y = (y.astype(np.float32) - 16) * (1 / 219)
+    # Upsample the half resolution chroma planes
+    u = ((u.astype(np.float32) - 128) * (1 / 224)).repeat(2, axis=0).repeat(2, axis=1)
+    v = ((v.astype(np.float32) - 128) * (1 / 224)).repeat(2, axis=0).repeat(2, axis=1)
+
+    rgb = np.empty((height, width, 3), dtype=np.float32)
+    rgb[..., 0] = y + 1.5748 * v
+    rgb[..., 1] = y - 0.1873 * u - 0.4681 * v
+    rgb[..., 2] = y + 1.8556 * u
+    return np.clip(rgb, 0, 1, out=rgb)